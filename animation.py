@@ -0,0 +1,331 @@
+"""Animated graphs: a fixed topology whose nodes move over time.
+
+Moves are given as a stream of updates, one per frame, each being
+the (M,) indexes of moved nodes and their (M, 3) new coords,
+for instance read from a text file by load_updates.
+
+With a fixed camera, an Animation keeps the projections of all nodes and
+the last frame. At each update, only the moved nodes are projected again,
+and only the screen tiles crossed by them and their links, before or after
+the move, are drawn again. Moved links and nodes are placed again in the index
+of tiles, so that the cost of a frame depends on the number of moved nodes,
+not on the size of the graph nor on the moves of former frames.
+When the dirty tiles hold most of the drawn items, as with long links crossing
+the whole screen, the frame is drawn again at once.
+
+"""
+
+import collections
+
+import numpy as np
+
+import graph as graph_module
+import projection
+import raster
+import render_gif
+import loaders
+import spatial
+from projection import POV
+
+
+TILE_SIZE = 16  # side in pixels of the screen tiles drawn again when dirty
+TILE_MARGIN = 2  # pixels around primitives considered as covered, for rounding and antialiasing
+FULL_REDRAW_RATIO = 0.5  # the whole frame is drawn again when dirty tiles hold that ratio of the drawn items
+REBUILD_RATIO = 0.25  # tiles are indexed at once again when that ratio of links moved since the last indexing
+
+
+class Animation:
+    """Frames of a graph seen by a fixed POV, drawn incrementally
+    as its nodes move. Frames are drawn by the numpy rasterizer,
+    and are the same as the ones drawn by render_gif.draw_projected_graph.
+
+    """
+
+    def __init__(self, graph, pov:POV, width:int=400, height:int=400,
+                 antialias:bool=False, depth_test:bool=False, tile_size:int=TILE_SIZE):
+        graph = graph_module.as_array_graph(graph)
+        self.nodes = np.array(graph.nodes, dtype=float)  # copy, updated by moves
+        self.links = np.asarray(graph.links, dtype=np.intp).reshape(-1, 2)
+        self.pov, self.width, self.height = pov, width, height
+        self.antialias, self.depth_test = antialias, depth_test
+        self.tile_size = tile_size
+        self.nb_tiles = -(-width // tile_size), -(-height // tile_size)
+        # links of each node are a contiguous range of incident_links
+        ends = self.links.T.reshape(-1)
+        order = np.argsort(ends, kind='stable')
+        self.incident_links = np.tile(np.arange(len(self.links)), 2)[order]
+        self.incident_offsets = np.searchsorted(ends[order], np.arange(len(self.nodes) + 1))
+
+        self.projections, self.visible = projection.project_many(self.nodes, pov)
+        self.center = projection.projection(graph.center, pov)
+        self.kept = self.visible[self.links].all(axis=1)
+        self.degrees = np.bincount(self.links[self.kept].reshape(-1), minlength=len(self.nodes))
+        self._index_tiles()
+        self.frame = render_gif.draw_projected_graph(
+            self.projections, self.visible, self.links, fname=None, center=self.center,
+            width=width, height=height, backend='numpy', antialias=antialias, depth_test=depth_test)
+
+    def update(self, indexes:np.ndarray, coords:np.ndarray) -> np.ndarray:
+        """Move nodes of given indexes to given coords, and return the new frame"""
+        indexes = np.asarray(indexes, dtype=np.intp).reshape(-1)
+        if not len(indexes):
+            return self.frame
+        links = np.unique(self.incident_links[spatial.expand_ranges(self.incident_offsets[indexes],
+                                                                    self.incident_offsets[indexes + 1])])
+        nodes = np.union1d(indexes, self.links[links].reshape(-1))
+        dirty = [self._covered_tiles(links, nodes)[1]]  # where they were drawn
+
+        self.nodes[indexes] = coords
+        self.projections[indexes], self.visible[indexes] = projection.project_many(self.nodes[indexes], self.pov)
+        np.subtract.at(self.degrees, self.links[links[self.kept[links]]].reshape(-1), 1)
+        self.kept[links] = self.visible[self.links[links]].all(axis=1)
+        np.add.at(self.degrees, self.links[links[self.kept[links]]].reshape(-1), 1)
+        self.nb_moved_links += np.count_nonzero(~self.moved_links[links])
+        if self.nb_moved_links > REBUILD_RATIO * len(self.links):
+            self._index_tiles()
+            dirty.append(self._covered_tiles(links, nodes)[1])  # where they are drawn now
+        else:
+            dirty.append(self._place(links, nodes))
+        self._draw_tiles(np.unique(np.concatenate(dirty)))
+        return self.frame
+
+    def play(self, updates) -> iter:
+        """Yield a copy of the frame before any update, then after each of given updates"""
+        yield self.frame.copy()
+        for indexes, coords in updates:
+            yield self.update(indexes, coords).copy()
+
+    def _scaled(self, items:np.ndarray) -> np.ndarray:
+        """Return the projections of given nodes in pixels, as given to draw_2d_graph"""
+        return self.projections[items] * (self.width, self.height, 1) + (0, 0, 1)
+
+    def drawn(self, nodes:np.ndarray) -> np.ndarray:
+        """Return the mask of given nodes drawn in the frame, being the visible nodes
+        with a visible link, as in render_gif.draw_projected_graph"""
+        return self.visible[nodes] & (self.degrees[nodes] > 0)
+
+    def _covered_tiles(self, links:np.ndarray, nodes:np.ndarray) -> (np.ndarray, np.ndarray, np.ndarray):
+        """Return the pairs of given drawn links and nodes and of the tiles they cover,
+        as arrays of items and tiles, and the mask of pairs being links.
+        Links cover the tiles crossed by their segment, nodes the ones under their square."""
+        drawn_links, drawn_nodes = links[self.kept[links]], nodes[self.drawn(nodes)]
+        segments, tiles = _segment_tiles(self._scaled(self.links[drawn_links])[:, :, :2],
+                                         self.tile_size, self.nb_tiles)
+        stars = self._scaled(drawn_nodes)
+        squares, square_tiles = _box_tiles(np.trunc(stars[:, :2] - stars[:, 2:] / 2) - TILE_MARGIN,
+                                           np.trunc(stars[:, :2] + stars[:, 2:] / 2) + TILE_MARGIN,
+                                           self.tile_size, self.nb_tiles)
+        items = np.concatenate((drawn_links[segments], drawn_nodes[squares]))
+        of_links = np.arange(len(items)) < len(segments)
+        return items, np.concatenate((tiles, square_tiles)), of_links
+
+    def _place(self, links:np.ndarray, nodes:np.ndarray) -> np.ndarray:
+        """Index given moved links and nodes by the tiles they now cover,
+        instead of their former tiles, and return these tiles"""
+        self.moved_links[links] = True
+        self.moved_nodes[nodes] = True
+        items, tiles, of_links = self._covered_tiles(links, nodes)
+        self._moved_tile_links.place(links, items[of_links], tiles[of_links])
+        self._moved_tile_nodes.place(nodes, items[~of_links], tiles[~of_links])
+        return tiles
+
+    def _index_tiles(self):
+        """Index the drawn links and nodes by the tiles they cover, all at once.
+        Until the next indexing, moved links and nodes are indexed apart, one by one."""
+        self.moved_links = np.zeros(len(self.links), dtype=bool)
+        self.moved_nodes = np.zeros(len(self.nodes), dtype=bool)
+        self.nb_moved_links = 0
+        self._moved_tile_links, self._moved_tile_nodes = _MovedIndex(), _MovedIndex()
+        items, tiles, of_links = self._covered_tiles(np.arange(len(self.links)), np.arange(len(self.nodes)))
+        self._tile_links = _Index(items[of_links], tiles[of_links], self.nb_tiles)
+        self._tile_nodes = _Index(items[~of_links], tiles[~of_links], self.nb_tiles)
+
+    def _draw_tiles(self, tiles:np.ndarray):
+        """Draw again the primitives covering given tiles, each one once,
+        or the whole frame if they are more than FULL_REDRAW_RATIO of the drawn ones"""
+        # moved links and nodes are found in their own index, not in the one of all items;
+        #  items are marked rather than sorted to be counted once
+        marked = np.zeros(len(self.links), dtype=bool)
+        marked[self._tile_links.items_of(tiles)] = True
+        marked &= ~self.moved_links
+        for tile in tiles.tolist():
+            marked[self._moved_tile_links[tile]] = True
+        links = np.flatnonzero(marked & self.kept)
+        marked = np.zeros(len(self.nodes), dtype=bool)
+        marked[self._tile_nodes.items_of(tiles)] = True
+        marked &= ~self.moved_nodes
+        for tile in tiles.tolist():
+            marked[self._moved_tile_nodes[tile]] = True
+        nodes = np.flatnonzero(marked)
+        nodes = nodes[self.drawn(nodes)]
+        if len(links) + len(nodes) > FULL_REDRAW_RATIO * (np.count_nonzero(self.kept)
+                                                          + np.count_nonzero(self.visible)):
+            all_nodes = np.arange(len(self.nodes))
+            self.frame = self._draw(np.flatnonzero(self.kept), all_nodes[self.drawn(all_nodes)],
+                                    0, 0, self.width, self.height)
+            return
+        # primitives are drawn in the box around the tiles, then copied in the tiles only
+        rows, columns = np.divmod(tiles, self.nb_tiles[0])
+        x0, y0 = columns.min() * self.tile_size, rows.min() * self.tile_size
+        x1 = min((columns.max() + 1) * self.tile_size, self.width)
+        y1 = min((rows.max() + 1) * self.tile_size, self.height)
+        dirty = np.zeros((rows.max() - rows.min() + 1, columns.max() - columns.min() + 1), dtype=bool)
+        dirty[rows - rows.min(), columns - columns.min()] = True
+        dirty = dirty.repeat(self.tile_size, axis=0).repeat(self.tile_size, axis=1)[:y1-y0, :x1-x0]
+        self.frame[y0:y1, x0:x1][dirty] = self._draw(links, nodes, x0, y0, x1, y1)[dirty]
+
+    def _draw(self, links:np.ndarray, nodes:np.ndarray, x0:int, y0:int, x1:int, y1:int) -> np.ndarray:
+        """Return the RGBA array of the pixels from (x0, y0) to (x1, y1) excluded,
+        where given links and nodes are drawn as by render_gif.draw_2d_graph"""
+        rasterizer = raster.NumpyRasterizer(x1 - x0, y1 - y0, antialias=self.antialias,
+                                            depth_test=self.depth_test, origin=(x0, y0))
+        segments = self._scaled(self.links[links])
+        rasterizer.draw_lines(segments[:, :, :2], raster.WHITE,
+                              depths=segments[:, :, 2] if self.depth_test else None)
+        stars = _unique_rows(self._scaled(nodes))  # same order as in draw_2d_graph
+        rasterizer.draw_squares(stars[:, :2], stars[:, 2], render_gif.star_colors(stars[:, 2]),
+                                depths=stars[:, 2] if self.depth_test else None)
+        if self.center:
+            x, y, size = self.center
+            rasterizer.draw_squares(((x * self.width, y * self.height),), (size,), raster.RED)
+        return rasterizer.array()
+
+
+class _Index:
+    """Items grouped by tile, so that items of a tile are a contiguous range"""
+
+    def __init__(self, items:np.ndarray, tiles:np.ndarray, nb_tiles:(int, int)):
+        order = np.argsort(tiles, kind='stable')
+        self.items = items[order]
+        self.offsets = np.searchsorted(tiles[order], np.arange(nb_tiles[0] * nb_tiles[1] + 1))
+
+    def __getitem__(self, tile:int) -> np.ndarray:
+        return self.items[self.offsets[tile]:self.offsets[tile+1]]
+
+    def items_of(self, tiles:np.ndarray) -> np.ndarray:
+        """Return the concatenation of the items of given tiles"""
+        return self.items[spatial.expand_ranges(self.offsets[tiles], self.offsets[tiles + 1])]
+
+
+class _MovedIndex:
+    """Items grouped by tile, updated item by item as they move"""
+
+    def __init__(self):
+        self.tiles_of_item = {}
+        self.items_of_tile = collections.defaultdict(set)
+
+    def place(self, moved:np.ndarray, items:np.ndarray, tiles:np.ndarray):
+        """Forget the tiles of given moved items, then add the pairs of given
+        items and tiles they now cover. Moved items without tile are not drawn."""
+        for item in moved.tolist():
+            for tile in self.tiles_of_item.pop(item, ()):
+                self.items_of_tile[tile].discard(item)
+        order = np.argsort(items, kind='stable')
+        items, tiles = items[order], tiles[order]
+        bounds = np.flatnonzero(np.diff(items)) + 1
+        for item, item_tiles in zip(items[np.r_[0, bounds]].tolist() if len(items) else (),
+                                    np.split(tiles, bounds)):
+            self.tiles_of_item[item] = item_tiles = item_tiles.tolist()
+            for tile in item_tiles:
+                self.items_of_tile[tile].add(item)
+
+    def __getitem__(self, tile:int) -> np.ndarray:
+        items = self.items_of_tile.get(tile)
+        return np.fromiter(items, dtype=np.intp, count=len(items)) if items else np.empty(0, dtype=np.intp)
+
+
+def _unique_rows(rows:np.ndarray) -> np.ndarray:
+    """Return np.unique(rows, axis=0), computed faster by a lexicographic sort"""
+    rows = rows[np.lexsort(rows.T[::-1])]
+    distinct = np.ones(len(rows), dtype=bool)
+    distinct[1:] = (rows[1:] != rows[:-1]).any(axis=1)
+    return rows[distinct]
+
+
+def _box_tiles(low:np.ndarray, high:np.ndarray, tile_size:int,
+               nb_tiles:(int, int)) -> (np.ndarray, np.ndarray):
+    """Return the indexes of given (B, 2) pixel boxes and of the tiles they cover,
+    as pairs of arrays, for tiles of the screen"""
+    low = np.clip(np.floor_divide(low, tile_size), 0, np.array(nb_tiles) - 1).astype(np.intp)
+    high = np.clip(np.floor_divide(high, tile_size), -1, np.array(nb_tiles) - 1).astype(np.intp)
+    sides = np.maximum(high - low + 1, 0)
+    counts = sides[:, 0] * sides[:, 1]
+    boxes = np.repeat(np.arange(len(counts)), counts)
+    idx = spatial.expand_ranges(np.zeros(len(counts), dtype=np.intp), counts)
+    columns = low[boxes, 0] + idx % np.maximum(sides[boxes, 0], 1)
+    rows = low[boxes, 1] + idx // np.maximum(sides[boxes, 0], 1)
+    return boxes, rows * nb_tiles[0] + columns
+
+
+def _segment_tiles(segments:np.ndarray, tile_size:int,
+                   nb_tiles:(int, int)) -> (np.ndarray, np.ndarray):
+    """Return the indexes of given (K, 2, 2) pixel segments and of the tiles
+    crossed by them, enlarged by TILE_MARGIN, as pairs of arrays.
+
+    Each segment is cut in strips of one tile along its major axis. In a strip,
+    the segment spans at most one tile and a half along its minor axis,
+    so it covers one to three tiles of the strip.
+
+    """
+    starts, ends = segments[:, 0], segments[:, 1]
+    x_major = np.abs(ends[:, 0] - starts[:, 0]) >= np.abs(ends[:, 1] - starts[:, 1])
+    major, minor = np.where(x_major, 0, 1), np.where(x_major, 1, 0)
+    index = np.arange(len(segments))
+    a0, a1 = starts[index, major], ends[index, major]
+    b0, b1 = starts[index, minor], ends[index, minor]
+    reverse = a0 > a1
+    a0, a1 = np.where(reverse, a1, a0), np.where(reverse, a0, a1)
+    b0, b1 = np.where(reverse, b1, b0), np.where(reverse, b0, b1)
+    nb_tiles = np.array(nb_tiles)
+    nb_major, nb_minor = nb_tiles[major], nb_tiles[minor]
+    # strips along the major axis
+    first = np.maximum(np.floor((a0 - TILE_MARGIN) / tile_size), 0).astype(np.intp)
+    last = np.minimum(np.floor((a1 + TILE_MARGIN) / tile_size), nb_major - 1).astype(np.intp)
+    counts = np.maximum(last - first + 1, 0)
+    strip_segments = np.repeat(index, counts)
+    strips = first[strip_segments] + spatial.expand_ranges(np.zeros(len(counts), dtype=np.intp), counts)
+    # span of the segment on the minor axis in each strip
+    a0, a1, b0, b1 = a0[strip_segments], a1[strip_segments], b0[strip_segments], b1[strip_segments]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slopes = np.where(a1 > a0, (b1 - b0) / (a1 - a0), 0)
+    low = b0 + slopes * (np.clip(strips * tile_size, a0, a1) - a0)
+    high = b0 + slopes * (np.clip((strips + 1) * tile_size, a0, a1) - a0)
+    low, high = np.minimum(low, high) - TILE_MARGIN, np.maximum(low, high) + TILE_MARGIN
+    first = np.maximum(np.floor(low / tile_size), 0).astype(np.intp)
+    last = np.minimum(np.floor(high / tile_size), nb_minor[strip_segments] - 1).astype(np.intp)
+    counts = np.maximum(last - first + 1, 0)
+    pairs = np.repeat(np.arange(len(strips)), counts)
+    crossed = first[pairs] + spatial.expand_ranges(np.zeros(len(counts), dtype=np.intp), counts)
+    along = strips[pairs]
+    is_x_major = x_major[strip_segments[pairs]]
+    columns, rows = np.where(is_x_major, along, crossed), np.where(is_x_major, crossed, along)
+    return strip_segments[pairs], rows * nb_tiles[0] + columns
+
+
+def load_updates(fname:str, delimiter:str=None, chunk_size:int=loaders.CHUNK_SIZE) -> iter:
+    """Yield the (indexes, coords) updates of nodes positions found in given text file,
+    one per frame. Each line holds a frame number, a node index and its x, y, z coords,
+    and lines are sorted by frame. Frames without line give an empty update."""
+    pending, next_frame = [], 0
+    for chunk in loaders.iter_text_chunks(fname, delimiter=delimiter, chunk_size=chunk_size):
+        frames = chunk[:, 0].astype(np.intp)
+        bounds = np.flatnonzero(np.diff(frames)) + 1
+        for part in np.split(np.arange(len(chunk)), bounds):
+            frame = frames[part[0]]
+            if pending and frame != pending[0][0]:
+                next_frame = yield from _flush(pending, next_frame)
+                pending = []
+            pending.append((frame, chunk[part]))
+    if pending:
+        yield from _flush(pending, next_frame)
+
+
+def _flush(pending:[(int, np.ndarray)], next_frame:int) -> iter:
+    """Yield the update of the frame made of given rows, preceded by empty updates
+    of the frames without rows since next_frame, and return the following frame"""
+    frame = pending[0][0]
+    for _ in range(next_frame, frame):
+        yield np.empty(0, dtype=np.intp), np.empty((0, 3))
+    rows = np.concatenate([rows for _, rows in pending])
+    yield rows[:, 1].astype(np.intp), rows[:, 2:5]
+    return frame + 1
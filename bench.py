@@ -0,0 +1,150 @@
+"""Benchmark of the rendering stages on synthetic graphs.
+
+Usage:
+
+    python bench.py --sizes 10 1000 100000 --output bench.json
+    python bench.py --baseline bench.json  # exit with 1 on regression
+
+Each stage is timed separately, then run again under tracemalloc
+to get its peak memory.
+
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from collections import namedtuple
+
+import graph as graph_module
+import projection
+import render_gif
+from graph import GENERATORS
+from projection import Coords
+
+
+DEFAULT_SIZES = (10, 1000, 100000)
+SCALAR_SAMPLE = 10000  # at most that many nodes are given to projection.projection
+GIF_FRAMES = 10
+NOISE_SECONDS = 0.002  # slowdowns smaller than that are timing noise, not regressions
+Result = namedtuple('Result', 'kind, size, stage, seconds, throughput, unit, peak_memory')
+# kind: name of the graph generator
+# size: number of nodes asked to the generator
+# stage: name of the benchmarked function
+# seconds: best time over the repeats
+# throughput: number of units processed by second
+# unit: 'nodes/s' or 'frames/s'
+# peak_memory: peak of memory allocated during the stage, in bytes
+
+
+def measure(func, repeat:int=3) -> (float, int):
+    """Return best time in seconds over repeated calls of func,
+    and peak memory allocated during an additional call"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def bench_graph(kind:str, size:int, repeat:int=3, workdir:str='.') -> [Result]:
+    graph = GENERATORS[kind](size)
+    center = graph.center
+    pov_coords = Coords(center.x + max(graph.amplitudes) * 2.35 + 1, center.y, center.z)
+    pov = projection.create_pov_toward(center, pov_coords)
+    pinhole = pov._replace(model='pinhole')
+    nodes, edges = render_gif.graph_arrays(graph)
+    nb_node = len(nodes)
+    sample = tuple(map(Coords._make, nodes[:SCALAR_SAMPLE].tolist()))
+    projections, visible = projection.project_many(nodes, pov)
+    kept_edges = edges[visible[edges].all(axis=1)]
+    graph_2d = projections[kept_edges]
+    frames = list(render_gif.run_things(graph, nb_point=GIF_FRAMES, fname_template=None))
+    gif_fname = os.path.join(workdir, 'bench.gif')
+
+    stages = (
+        ('projection', lambda: [projection.projection(node, pov) for node in sample], len(sample), 'nodes/s'),
+        ('project_many', lambda: projection.project_many(nodes, pov), nb_node, 'nodes/s'),
+        ('project_many[pinhole]', lambda: projection.project_many(nodes, pinhole), nb_node, 'nodes/s'),
+        ('draw_3d_graph', lambda: render_gif.draw_3d_graph(graph, pov_coords, fname=None), 1, 'frames/s'),
+        ('draw_2d_graph', lambda: render_gif.draw_2d_graph(graph_2d, fname=None), 1, 'frames/s'),
+        ('draw_2d_graph[numpy]', lambda: render_gif.draw_2d_graph(graph_2d, fname=None, backend='numpy'), 1, 'frames/s'),
+        ('write_gif', lambda: render_gif.write_gif(frames, fname=gif_fname), len(frames), 'frames/s'),
+        ('write_gif[delta]', lambda: render_gif.write_gif(frames, fname=gif_fname, delta=True), len(frames), 'frames/s'),
+    )
+    results = []
+    for stage, func, units, unit in stages:
+        seconds, peak = measure(func, repeat=repeat)
+        results.append(Result(kind, size, stage, seconds, units / seconds if seconds else float('inf'), unit, peak))
+    return results
+
+
+def compare(results:[Result], baseline:[Result], tolerance:float=0.2,
+            noise:float=NOISE_SECONDS) -> [(Result, Result)]:
+    """Return pairs (result, baseline) of results that are slower than
+    their baseline by more than given tolerance ratio, and by more than
+    given noise in seconds"""
+    reference = {(r.kind, r.size, r.stage): r for r in baseline}
+    return [
+        (result, reference[result.kind, result.size, result.stage])
+        for result in results
+        if (result.kind, result.size, result.stage) in reference
+        and result.seconds > reference[result.kind, result.size, result.stage].seconds * (1 + tolerance)
+        and result.seconds - reference[result.kind, result.size, result.stage].seconds > noise
+    ]
+
+
+def save_results(results:[Result], fname:str):
+    with open(fname, 'w') as fd:
+        json.dump([result._asdict() for result in results], fd, indent=1)
+
+def load_results(fname:str) -> [Result]:
+    with open(fname) as fd:
+        return [Result(**result) for result in json.load(fd)]
+
+
+def cli() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='numbers of nodes of the graphs')
+    parser.add_argument('--kinds', nargs='+', choices=tuple(GENERATORS), default=tuple(GENERATORS),
+                        help='graph generators to use')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs of each stage')
+    parser.add_argument('--output', default='bench.json', help='file where results are saved')
+    parser.add_argument('--baseline', default=None, help='results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='slowdown ratio over baseline considered as a regression')
+    parser.add_argument('--noise', type=float, default=NOISE_SECONDS,
+                        help='slowdown in seconds under which a stage is never considered as a regression')
+    return parser
+
+
+if __name__ == "__main__":
+    args = cli().parse_args()
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for kind in args.kinds:
+            for size in args.sizes:
+                for result in bench_graph(kind, size, repeat=args.repeat, workdir=workdir):
+                    print('{r.kind:>10} {r.size:>8} {r.stage:>20} {r.seconds:>10.4f}s'
+                          ' {r.throughput:>14.1f} {r.unit:<8} {peak:>10.1f}MB'
+                          ''.format(r=result, peak=result.peak_memory / 2**20))
+                    results.append(result)
+    save_results(results, args.output)
+    if args.baseline:
+        regressions = compare(results, load_results(args.baseline), args.tolerance, args.noise)
+        for result, reference in regressions:
+            print('REGRESSION: {r.kind} {r.size} {r.stage}: {r.seconds:.4f}s instead of {ref:.4f}s'
+                  ''.format(r=result, ref=reference.seconds))
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,149 @@
+"""Persistent cache of projections, stored on disk.
+
+Projections of the nodes of a graph for a POV are stored in a file named
+after a hash of the graph content (see graph_hash) and of the POV parameters,
+so that rendering again the same frames, for instance with another style,
+skips the projection.
+
+The cache size is bounded: least recently used files are removed
+when the total size goes over max_bytes. The total size is counted as files
+are written, and the directory is only scanned when it goes over max_bytes.
+
+"""
+
+import os
+import hashlib
+import tempfile
+import threading
+
+import numpy as np
+
+import projection
+from projection import POV
+
+
+DEFAULT_MAX_BYTES = 1 << 30
+CHUNK_SIZE = 1 << 20  # number of nodes hashed at once
+EXTENSION = '.proj'
+
+
+def graph_hash(nodes:np.ndarray, links:np.ndarray=None) -> str:
+    """Return a hash of the content of given nodes coords and links"""
+    digest = hashlib.sha1()
+    nodes = np.asanyarray(nodes)
+    digest.update(repr((nodes.shape, nodes.dtype.str)).encode())
+    for first in range(0, len(nodes), CHUNK_SIZE):
+        digest.update(np.ascontiguousarray(nodes[first:first+CHUNK_SIZE]).tobytes())
+    if links is not None:
+        digest.update(np.ascontiguousarray(links).tobytes())
+    return digest.hexdigest()
+
+
+class ProjectionCache:
+    """Cache of projection.project_many results in given directory"""
+
+    def __init__(self, directory:str, max_bytes:int=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.bytes = sum(size for _, size, _ in self._entries())  # total size of the files
+
+    def key(self, content_hash:str, pov:POV, dot_radius:float=10) -> str:
+        """Return the key of projections of the graph of given hash for given POV"""
+        parameters = (tuple(map(float, pov.coords)), tuple(map(float, pov.rotation)),
+                      float(pov.width), float(pov.height), *pov[4:], float(dot_radius))
+        return hashlib.sha1(repr((content_hash, parameters)).encode()).hexdigest()
+
+    def _path(self, key:str) -> str:
+        return os.path.join(self.directory, key + EXTENSION)
+
+    def get(self, key:str) -> (np.ndarray, np.ndarray) or None:
+        """Return the (projections, visible) stored for given key, or None"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fd:
+                nb_node = int(np.frombuffer(fd.read(8), dtype='<i8')[0])
+                projections = np.frombuffer(fd.read(nb_node * 24), dtype='<f8').reshape(nb_node, 3)
+                visible = np.unpackbits(np.frombuffer(fd.read(), dtype=np.uint8), count=nb_node).astype(bool)
+        except (FileNotFoundError, ValueError, IndexError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)  # the file is now the most recently used
+        except FileNotFoundError:  # removed by another process since read
+            pass
+        self.hits += 1
+        return projections, visible
+
+    def put(self, key:str, projections:np.ndarray, visible:np.ndarray):
+        """Store given projections and visibility mask under given key.
+        The file holds the number of nodes, the projections as float64
+        and the visibility mask as bits."""
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as out:
+            out.write(np.array(len(projections), dtype='<i8').tobytes())
+            out.write(np.ascontiguousarray(projections, dtype='<f8').tobytes())
+            out.write(np.packbits(visible).tobytes())
+            size = out.tell()
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp_path, path)  # readers never see partial files
+        with self._lock:
+            self.bytes += size - replaced
+            over = self.bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used files until the cache fits in max_bytes.
+        The total size is counted again from the files, as other processes
+        may have written or removed some."""
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:  # removed by another process
+                    pass
+                total -= size
+                self.evictions += 1
+            self.bytes = total
+
+    def _entries(self) -> [(float, int, str)]:
+        """Return the modification time, size and path of the files of the cache"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(EXTENSION):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # removed by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def project_many(self, nodes:np.ndarray, pov:POV, dot_radius:float=10,
+                     content_hash:str=None) -> (np.ndarray, np.ndarray):
+        """Return projection.project_many(nodes, pov, dot_radius), using the cache.
+        Giving the hash of nodes avoids its computation at each call."""
+        key = self.key(content_hash or graph_hash(nodes), pov, dot_radius)
+        cached = self.get(key)
+        if cached is None:
+            cached = projection.project_many(nodes, pov, dot_radius)
+            self.put(key, *cached)
+        return cached
+
+    def stats(self) -> dict:
+        sizes = [entry.stat().st_size for entry in os.scandir(self.directory)
+                 if entry.name.endswith(EXTENSION)]
+        return {
+            'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+            'entries': len(sizes), 'bytes': sum(sizes),
+        }
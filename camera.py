@@ -0,0 +1,147 @@
+"""Camera paths, giving the position of the camera along an animation.
+
+A path gives the (T, 3) positions of the camera for (T,) parameters in [0, 1].
+The camera looks at a target, that is either fixed coords or another path.
+
+Frames are sampled adaptively along a path with sample_povs: frames where
+the projected nodes move less than a threshold in pixels from the previous
+frame are merged into it, extending its duration.
+
+Sets of POVs for multi-view rendering (see render_gif.draw_views)
+are given by stereo_povs and contact_sheet_povs.
+
+"""
+
+import math
+from collections import namedtuple
+
+import numpy as np
+
+import projection
+from projection import Coords, POV, POV_WIDTH
+
+
+SAMPLE_NODES = 2048  # maximal number of nodes projected to measure the movement between frames
+
+
+class Circle(namedtuple('Circle', 'center, radius')):
+    """Horizontal circle around center, as the orbit of render_gif.run_things"""
+    closed = True
+
+    def positions(self, ts:np.ndarray) -> np.ndarray:
+        angles = 2 * math.pi * np.asarray(ts, dtype=float)
+        x, y, z = self.center
+        return np.stack((x + np.cos(angles) * self.radius, np.full_like(angles, y),
+                         z + np.sin(angles) * self.radius), axis=-1)
+
+
+class Helix(namedtuple('Helix', 'center, radius, rise, turns')):
+    """Circle around center, going up by rise from rise/2 below center"""
+    closed = False
+
+    def positions(self, ts:np.ndarray) -> np.ndarray:
+        ts = np.asarray(ts, dtype=float)
+        angles = 2 * math.pi * self.turns * ts
+        x, y, z = self.center
+        return np.stack((x + np.cos(angles) * self.radius, y + (ts - 0.5) * self.rise,
+                         z + np.sin(angles) * self.radius), axis=-1)
+
+
+class Spline(namedtuple('Spline', 'keyframes, closed')):
+    """Catmull-Rom spline going through the (K, 3) keyframes, in order.
+    Keyframes are evenly spaced in parameter."""
+
+    def __new__(cls, keyframes:np.ndarray, closed:bool=False):
+        keyframes = np.asarray(keyframes, dtype=float).reshape(-1, 3)
+        if len(keyframes) < 2:
+            raise ValueError("A spline needs at least 2 keyframes")
+        return super().__new__(cls, keyframes, closed)
+
+    def positions(self, ts:np.ndarray) -> np.ndarray:
+        keyframes = self.keyframes
+        nb_segment = len(keyframes) if self.closed else len(keyframes) - 1
+        if self.closed:
+            controls = np.concatenate((keyframes[-1:], keyframes, keyframes[:2]))
+        else:  # end tangents are given by mirrored keyframes
+            controls = np.concatenate((2 * keyframes[:1] - keyframes[1:2], keyframes,
+                                       2 * keyframes[-1:] - keyframes[-2:-1]))
+        scaled = np.asarray(ts, dtype=float) * nb_segment
+        segments = np.clip(np.floor(scaled).astype(np.intp), 0, nb_segment - 1)
+        u = (scaled - segments)[..., np.newaxis]
+        p0, p1, p2, p3 = (controls[segments + offset] for offset in range(4))
+        return 0.5 * (2 * p1 + (p2 - p0) * u + (2 * p0 - 5 * p1 + 4 * p2 - p3) * u**2
+                      + (3 * p1 - p0 - 3 * p2 + p3) * u**3)
+
+
+def parameters(path, nb_frame:int) -> np.ndarray:
+    """Return nb_frame evenly spaced parameters along given path.
+    The end of a closed path is not given, as it is its start."""
+    return np.linspace(0, 1, nb_frame, endpoint=not path.closed)
+
+
+def targets_at(target, ts:np.ndarray) -> np.ndarray:
+    """Return the (T, 3) coords of given target (coords or path) at given parameters"""
+    if hasattr(target, 'positions'):
+        return target.positions(ts)
+    return np.broadcast_to(np.asarray(target, dtype=float), (len(ts), 3))
+
+
+def povs_along(path, target, ts:np.ndarray, width:float=POV_WIDTH,
+               height:float=POV_WIDTH) -> [POV]:
+    """Return the POVs placed along given path at given parameters,
+    looking at given target (coords or path)"""
+    return [projection.pov_looking_at(Coords(*aimed), Coords(*position), width, height)
+            for position, aimed in zip(path.positions(ts).tolist(), targets_at(target, ts).tolist())]
+
+
+def sample_povs(path, target, nodes:np.ndarray, nb_frame:int=100, threshold:float=1.,
+                size:(int, int)=(400, 400), duration:float=1,
+                width:float=POV_WIDTH, height:float=POV_WIDTH) -> ([POV], [float]):
+    """Return POVs along given path looking at target, and the duration of each frame.
+
+    The path is sampled at nb_frame evenly spaced parameters, each one lasting
+    given duration. A sample is kept only if a node moved by more than threshold
+    pixels on a screen of given size, or entered or left the field of view,
+    since the last kept sample. Otherwise its duration is added to the last kept one.
+    Movement is measured on at most SAMPLE_NODES nodes.
+
+    """
+    povs = povs_along(path, target, parameters(path, nb_frame), width, height)
+    nodes = np.asarray(nodes, dtype=float).reshape(-1, 3)
+    nodes = nodes[::max(1, len(nodes) // SAMPLE_NODES)]
+    projections, visible = projection.project_orbit(nodes, povs)
+    pixels = projections[..., :2] * size
+    kept, durations = [0], [duration]
+    for index in range(1, len(povs)):
+        last = kept[-1]
+        both = visible[index] & visible[last]
+        moved = (visible[index] != visible[last]).any() or (
+            both.any() and np.abs(pixels[index][both] - pixels[last][both]).max() > threshold)
+        if moved:
+            kept.append(index)
+            durations.append(duration)
+        else:
+            durations[-1] += duration
+    return [povs[index] for index in kept], durations
+
+
+def stereo_povs(target:Coords, pov_coords:Coords, eye_distance:float,
+                width:float=POV_WIDTH, height:float=POV_WIDTH) -> [POV]:
+    """Return the left and right POVs of a stereo pair, separated
+    by eye_distance horizontally, with parallel view axes toward target"""
+    target, position = np.asarray(target, dtype=float), np.asarray(pov_coords, dtype=float)
+    side = np.cross(target - position, (0, 1, 0))
+    if not np.any(side):
+        raise ValueError("Stereo POVs can't look vertically")
+    offset = side / np.linalg.norm(side) * eye_distance / 2
+    return [projection.pov_looking_at(Coords(*(target + shift)), Coords(*(position + shift)), width, height)
+            for shift in (-offset, offset)]
+
+
+def contact_sheet_povs(center:Coords, distance:float, width:float=POV_WIDTH,
+                       height:float=POV_WIDTH) -> [POV]:
+    """Return the front, side, top and diagonal POVs looking at center from given distance"""
+    directions = np.array(((1, 0, 0), (0, 0, 1), (0, 1, 0), np.ones(3) / np.sqrt(3)))
+    center = np.asarray(center, dtype=float)
+    return [projection.pov_looking_at(Coords(*center), Coords(*(center + direction * distance)), width, height)
+            for direction in directions]
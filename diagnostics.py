@@ -0,0 +1,138 @@
+"""Debug logging and per-stage timing of the rendering.
+
+Debug messages are sent to the standard logging module, under loggers
+named after the modules. They are disabled by default.
+
+Timing is recorded only while a Profiler is active:
+
+    with diagnostics.profiling() as profiler:
+        write_gif(run_things(graph))
+    profiler.to_chrome_trace('trace.json')
+
+When no profiler is active, stage() returns a shared no-op context manager.
+Stages run in pool workers (see run_things' workers) are not recorded.
+
+"""
+
+import os
+import json
+import time
+import threading
+import contextlib
+from collections import namedtuple, defaultdict
+
+
+STAGES = ('projection', 'graph_2d', 'rasterize', 'encode')  # stages recorded by the renderer
+Event = namedtuple('Event', 'name, frame, start, duration, thread')
+# name: name of the stage
+# frame: number of the frame being rendered, tuple of the numbers of the frames
+#  sharing the stage (see frames()), or None
+# start: time.perf_counter() at stage start, in seconds
+# duration: in seconds
+# thread: identifier of the thread that ran the stage
+
+
+class Profiler:
+    """Record the time spent in each stage of the rendering, frame by frame"""
+
+    def __init__(self):
+        self.events = []
+        self.current_frame = None
+        self.origin = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name:str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.events.append(Event(name, self.current_frame, start,
+                                     time.perf_counter() - start, threading.get_ident()))
+
+    @contextlib.contextmanager
+    def frame(self, num:int):
+        previous, self.current_frame = self.current_frame, num
+        try:
+            with self.stage('frame'):
+                yield
+        finally:
+            self.current_frame = previous
+
+    @contextlib.contextmanager
+    def frames(self, nums:[int]):
+        previous, self.current_frame = self.current_frame, tuple(nums)
+        try:
+            yield
+        finally:
+            self.current_frame = previous
+
+    def summary(self) -> {str: float}:
+        """Return the total time in seconds spent in each stage"""
+        totals = defaultdict(float)
+        for event in self.events:
+            totals[event.name] += event.duration
+        return dict(totals)
+
+    def by_frame(self) -> {int: {str: float}}:
+        """Return the time in seconds spent in each stage, for each frame.
+        Stages shared by frames are split evenly between them."""
+        frames = defaultdict(lambda: defaultdict(float))
+        for event in self.events:
+            if isinstance(event.frame, tuple):
+                for num in event.frame:
+                    frames[num][event.name] += event.duration / len(event.frame)
+            elif event.frame is not None:
+                frames[event.frame][event.name] += event.duration
+        return {frame: dict(stages) for frame, stages in frames.items()}
+
+    def to_json(self, fname:str):
+        with open(fname, 'w') as fd:
+            json.dump({
+                'summary': self.summary(),
+                'frames': self.by_frame(),
+                'events': [event._asdict() for event in self.events],
+            }, fd, indent=1)
+
+    def to_chrome_trace(self, fname:str):
+        """Write events in the Chrome trace event format,
+        readable by chrome://tracing or Perfetto"""
+        pid = os.getpid()
+        events = [{
+            'name': event.name, 'cat': 'render', 'ph': 'X',
+            'ts': (event.start - self.origin) * 1e6, 'dur': event.duration * 1e6,
+            'pid': pid, 'tid': event.thread,
+            'args': {} if event.frame is None else {'frame': event.frame},
+        } for event in self.events]
+        with open(fname, 'w') as fd:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fd)
+
+
+PROFILER = None  # the active profiler, if any
+_NO_OP = contextlib.nullcontext()
+
+
+def stage(name:str):
+    """Return a context manager timing given stage in the active profiler"""
+    return _NO_OP if PROFILER is None else PROFILER.stage(name)
+
+
+def frame(num:int):
+    """Return a context manager marking the stages inside as part of given frame"""
+    return _NO_OP if PROFILER is None else PROFILER.frame(num)
+
+
+def frames(nums:[int]):
+    """Return a context manager marking the stages inside as shared by given frames,
+    for instance a projection of a batch of frames"""
+    return _NO_OP if PROFILER is None else PROFILER.frames(nums)
+
+
+@contextlib.contextmanager
+def profiling(profiler:Profiler=None):
+    """Activate given or new profiler during the context"""
+    global PROFILER
+    previous, PROFILER = PROFILER, profiler or Profiler()
+    try:
+        yield PROFILER
+    finally:
+        PROFILER = previous
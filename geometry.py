@@ -2,12 +2,133 @@
 
 """
 import math
+import functools
 from collections import namedtuple
 
+import numpy as np
+
 Coords = namedtuple('Coords', 'x, y, z')
 Coords2D = namedtuple('Coords2D', 'x, y')
 
 
+ROTATION_CACHE_SIZE = 1024  # number of rotation transforms kept in cache
+
+
+class Transform:
+    """Affine transformation of the 3D space, held as a 4x4 matrix
+    working on homogeneous coordinates.
+
+    Transforms are composed with the @ operator: (a @ b) applies b, then a.
+
+    """
+    __slots__ = ('matrix', '_rows')
+
+    def __init__(self, matrix:np.ndarray):
+        self.matrix = np.array(matrix, dtype=float)
+        self.matrix.flags.writeable = False
+        # python floats are faster than numpy ones when working on single points
+        self._rows = tuple(map(tuple, self.matrix[:3].tolist()))
+
+    @staticmethod
+    def identity() -> 'Transform':
+        return Transform(np.eye(4))
+
+    @staticmethod
+    def translation(offset:Coords) -> 'Transform':
+        matrix = np.eye(4)
+        matrix[:3, 3] = offset
+        return Transform(matrix)
+
+    @staticmethod
+    def rotation(rotation:Coords) -> 'Transform':
+        """Return the transform rotating each axis by given angles (in degrees),
+        in x, y, z order. Transforms are cached by rotation."""
+        return rotation_transform(tuple(map(float, rotation)))
+
+    @staticmethod
+    def system(origin:Coords, rotation:Coords) -> 'Transform':
+        """Return the transform from the standard system to the system
+        of given origin and rotation (in degrees), as in coords_in_system"""
+        return Transform.rotation(rotation) @ Transform.translation(tuple(-v for v in origin))
+
+    @staticmethod
+    def perspective(width:float, height:float, near:float, far:float=math.inf) -> 'Transform':
+        """Return the projection of a pinhole camera looking along the x axis,
+        with given horizontal (z) and vertical (y) fields of view (in degrees).
+
+        Homogeneous coords (x, y, z, 1) become (X, Y, D, W) with W = x, so that
+        X/W and Y/W are the position on screen in [0, 1] for points in the field
+        of view, y going downward, and D/W is in [0, 1] for x between near and far.
+
+        """
+        x_scale = 1 / (2 * math.tan(math.radians(width) / 2))
+        y_scale = 1 / (2 * math.tan(math.radians(height) / 2))
+        depth_scale = 1. if math.isinf(far) else far / (far - near)
+        return Transform((
+            (0.5, 0, x_scale, 0),
+            (0.5, -y_scale, 0, 0),
+            (depth_scale, 0, 0, -near * depth_scale),
+            (1, 0, 0, 0),
+        ))
+
+    def __matmul__(self, other:'Transform') -> 'Transform':
+        return Transform(self.matrix @ other.matrix)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Transform) and np.array_equal(self.matrix, other.matrix)
+
+    def __hash__(self) -> int:
+        return hash(self._rows)
+
+    def __repr__(self) -> str:
+        return 'Transform({})'.format(self.matrix.tolist())
+
+    def inverse(self) -> 'Transform':
+        return Transform(np.linalg.inv(self.matrix))
+
+    def apply(self, point:Coords) -> Coords:
+        """Return the coords of given point after transformation"""
+        px, py, pz = point
+        (a, b, c, d), (e, f, g, h), (i, j, k, l) = self._rows
+        return Coords(a*px + b*py + c*pz + d, e*px + f*py + g*pz + h, i*px + j*py + k*pz + l)
+
+    def apply_many(self, points:np.ndarray) -> np.ndarray:
+        """Vectorized version of apply, working on a (N, 3) array"""
+        points = np.asarray(points, dtype=float)
+        return points @ self.matrix[:3, :3].T + self.matrix[:3, 3]
+
+
+@functools.lru_cache(maxsize=ROTATION_CACHE_SIZE)
+def rotation_transform(rotation:(float, float, float)) -> Transform:
+    """Return the Transform rotating each axis by given angles (in degrees).
+    Prefer Transform.rotation, that normalizes the cache key."""
+    x_rotation, y_rotation, z_rotation = map(math.radians, rotation)
+    cos, sin = math.cos, math.sin
+    matrix = np.eye(4)
+    if x_rotation:
+        matrix = np.array((
+            (1, 0, 0, 0),
+            (0, cos(x_rotation), -sin(x_rotation), 0),
+            (0, sin(x_rotation), cos(x_rotation), 0),
+            (0, 0, 0, 1),
+        )) @ matrix
+    if y_rotation:
+        matrix = np.array((
+            (cos(y_rotation), 0, -sin(y_rotation), 0),
+            (0, 1, 0, 0),
+            (sin(y_rotation), 0, cos(y_rotation), 0),
+            (0, 0, 0, 1),
+        )) @ matrix
+    if z_rotation:
+        matrix = np.array((
+            (cos(z_rotation), -sin(z_rotation), 0, 0),
+            (sin(z_rotation), cos(z_rotation), 0, 0),
+            (0, 0, 1, 0),
+            (0, 0, 0, 1),
+        )) @ matrix
+    return Transform(matrix)
+
+
 def coords_in_system(point:Coords, system_origin:Coords,
                      system_rotation:Coords) -> Coords:
     """Return the coords of given point in the coordinate system
@@ -19,28 +140,22 @@ def coords_in_system(point:Coords, system_origin:Coords,
     return point
 
 
+def coords_in_system_many(points:np.ndarray, system_origin:Coords,
+                          system_rotation:Coords) -> np.ndarray:
+    """Vectorized version of coords_in_system, working on a (N, 3) array"""
+    points = np.asarray(points, dtype=float) - np.asarray(system_origin, dtype=float)
+    return with_rotated_axis_many(points, system_rotation)
+
+
 def with_rotated_axis(point:Coords, rotation:Coords) -> Coords:
     """Returns coordinates of given point after given rotation
     (in degrees) for each axis"""
-    x_rotation, y_rotation, z_rotation = map(math.radians, rotation)
-    px, py, pz = point
-    cos, sin = math.cos, math.sin
-    if x_rotation:
-        py, pz = (
-            py * cos(x_rotation) - pz * sin(x_rotation),
-            py * sin(x_rotation) + pz * cos(x_rotation)
-        )
-    if y_rotation:
-        px, pz = (
-            px * cos(y_rotation) - pz * sin(y_rotation),
-            px * sin(y_rotation) + pz * cos(y_rotation)
-        )
-    if z_rotation:
-        px, py = (
-            px * cos(z_rotation) - py * sin(z_rotation),
-            px * sin(z_rotation) + py * cos(z_rotation)
-        )
-    return Coords(px, py, pz)
+    return Transform.rotation(rotation).apply(point)
+
+
+def with_rotated_axis_many(points:np.ndarray, rotation:Coords) -> np.ndarray:
+    """Vectorized version of with_rotated_axis, working on a (N, 3) array"""
+    return Transform.rotation(rotation).apply_many(points)
 
 
 def angles_from_coords(coords:Coords) -> Coords:
@@ -53,6 +168,19 @@ def angles_from_coords(coords:Coords) -> Coords:
     return x, y, z
 
 
+def angles_from_coords_many(points:np.ndarray) -> (np.ndarray, np.ndarray):
+    """Vectorized version of angles_from_coords, working on a (N, 3) array.
+
+    Return the (N, 3) angles (in degrees) and the (N,) distances to origin.
+
+    """
+    dist = np.sqrt(np.sum(points**2, axis=-1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        angles = np.degrees(np.arccos(points / dist[..., np.newaxis]))
+    angles[dist == 0.] = 0.
+    return angles, dist
+
+
 def coords_from_angles(angles:Coords, distance:float=1.) -> Coords:
     """Return the coords at given distance of origin, and with line ((0, 0, 0), coords)
     having given angles (in degrees) with axis.
@@ -3,22 +3,79 @@ and repository of many example graphs.
 
 """
 
+import random
+import logging
 import itertools
 from collections import namedtuple
 
+import numpy as np
+
 from projection import Coords
 
+LOGGER = logging.getLogger(__name__)
 Graph = namedtuple('Graph', 'links, center, nodes, dimensions, amplitudes')
+ArrayGraph = namedtuple('ArrayGraph', 'links, center, nodes, dimensions, amplitudes')
+# links: (E, 2) integer array of indexes of linked nodes
+# nodes: (N, 3) float array of nodes coords
+# center, dimensions and amplitudes are as in Graph
 
 
 def graph_from_edges(graph:[(float, float, float), (float, float, float)]) -> Graph:
     nodes = frozenset(itertools.chain.from_iterable(graph))
-    print('NODES:', nodes)
+    LOGGER.debug('NODES: %s', nodes)
     center_ = Coords(*center(nodes))
-    print('CENTER:', center_)
+    LOGGER.debug('CENTER: %s', center_)
     return Graph(graph, center_, nodes, dimensions(nodes), amplitudes(nodes))
 
 
+def array_graph(nodes:np.ndarray, links:np.ndarray,
+                bounds:(np.ndarray, np.ndarray)=None) -> ArrayGraph:
+    """Return the ArrayGraph of given (N, 3) nodes coords and (E, 2) links between
+    nodes indexes. Bounds (minimal and maximal coords) are computed if not given.
+
+    Nodes arrays of float type, including memory mapped ones, are not copied.
+
+    """
+    nodes = np.asanyarray(nodes)
+    if nodes.dtype.kind != 'f':  # float32 and memory mapped arrays are kept as is
+        nodes = nodes.astype(float)
+    nodes = nodes.reshape(-1, 3)
+    links = np.asarray(links)
+    if links.dtype.kind not in 'iu':
+        links = links.astype(np.intp)
+    links = links.reshape(-1, 2)
+    mins, maxs = (nodes.min(axis=0), nodes.max(axis=0)) if bounds is None else bounds
+    mins, maxs = tuple(map(float, mins)), tuple(map(float, maxs))
+    return ArrayGraph(
+        links,
+        Coords(*(((high - low) / 2) + low for low, high in zip(mins, maxs))),
+        nodes,
+        tuple(zip(maxs, mins)),
+        tuple(high - low for low, high in zip(mins, maxs)),
+    )
+
+
+def array_graph_from_edges(graph:[(float, float, float), (float, float, float)]) -> ArrayGraph:
+    """Return the ArrayGraph of given edges, as accepted by graph_from_edges"""
+    ends = np.array(graph, dtype=float).reshape(-1, 3)
+    nodes, indexes = np.unique(ends, axis=0, return_inverse=True)
+    return array_graph(nodes, indexes.reshape(-1, 2))
+
+
+def edges_from_array_graph(graph:ArrayGraph) -> ((float, float, float), (float, float, float)):
+    """Return the edges of given ArrayGraph, as accepted by graph_from_edges"""
+    return tuple(
+        (tuple(source), tuple(target))
+        for source, target in graph.nodes[graph.links].tolist()
+    )
+
+
+def as_array_graph(graph:Graph or ArrayGraph) -> ArrayGraph:
+    if isinstance(graph, ArrayGraph):
+        return graph
+    return array_graph_from_edges(graph.links)
+
+
 def center(nodes:[(float, ..., float)]) -> (float, ..., float):
     """Return the center of given nodes in space of whatever dimension"""
     by_coords = tuple(zip(*nodes))
@@ -77,3 +134,68 @@ def double_tetrahedron() -> Graph:
         ((50, 50, 70), (80, 20, 50)),
         ((50, 50, 70), (80, 80, 50)),
     ))
+
+
+def random_cloud(nb_node:int, nb_link:int=None, seed:int=0, size:float=100.) -> Graph:
+    """Return a graph of nodes randomly placed in a cube of given size,
+    with nb_link (default to nb_node) random links between them.
+
+    Each link starts from a different node, so that all nodes belong
+    to the graph when nb_link >= nb_node.
+
+    """
+    rand = random.Random(seed)
+    nb_node = max(2, nb_node)
+    nodes = [tuple(rand.uniform(0, size) for _ in range(3)) for _ in range(nb_node)]
+    nb_link = nb_node if nb_link is None else nb_link
+    return graph_from_edges(tuple(
+        (nodes[idx % nb_node], nodes[(idx + rand.randrange(1, nb_node)) % nb_node])
+        for idx in range(nb_link)
+    ))
+
+
+def grid(nb_node:int, spacing:float=10.) -> Graph:
+    """Return a square grid in the plane z=0, with about nb_node nodes
+    linked to their neighbors"""
+    side = max(2, round(nb_node ** (1/2)))
+    node = lambda i, j: (i * spacing, j * spacing, 0.)
+    return graph_from_edges(tuple(itertools.chain(
+        ((node(i, j), node(i+1, j)) for i in range(side-1) for j in range(side)),
+        ((node(i, j), node(i, j+1)) for i in range(side) for j in range(side-1)),
+    )))
+
+
+def lattice(nb_node:int, spacing:float=10.) -> Graph:
+    """Return a cubic lattice, with about nb_node nodes
+    linked to their neighbors"""
+    side = max(2, round(nb_node ** (1/3)))
+    node = lambda i, j, k: (i * spacing, j * spacing, k * spacing)
+    cells = tuple(itertools.product(range(side), repeat=3))
+    return graph_from_edges(tuple(itertools.chain(
+        ((node(i, j, k), node(i+1, j, k)) for i, j, k in cells if i+1 < side),
+        ((node(i, j, k), node(i, j+1, k)) for i, j, k in cells if j+1 < side),
+        ((node(i, j, k), node(i, j, k+1)) for i, j, k in cells if k+1 < side),
+    )))
+
+
+def scale_free(nb_node:int, nb_link_per_node:int=2, seed:int=0, size:float=100.) -> Graph:
+    """Return a scale-free graph built by preferential attachment
+    (Barabási-Albert model), with nodes randomly placed in a cube of given size"""
+    rand = random.Random(seed)
+    nodes = [tuple(rand.uniform(0, size) for _ in range(3)) for _ in range(max(nb_node, nb_link_per_node + 1))]
+    links = [(nodes[0], nodes[idx]) for idx in range(1, nb_link_per_node + 1)]
+    targets = [0] * nb_link_per_node + list(range(1, nb_link_per_node + 1))  # one entry per link end
+    for idx in range(nb_link_per_node + 1, len(nodes)):
+        chosen = {rand.choice(targets) for _ in range(nb_link_per_node)}
+        links.extend((nodes[idx], nodes[target]) for target in chosen)
+        targets.extend(chosen)
+        targets.extend([idx] * len(chosen))
+    return graph_from_edges(tuple(links))
+
+
+GENERATORS = {  # name -> function returning a graph of about given number of nodes
+    'cloud': random_cloud,
+    'grid': grid,
+    'lattice': lattice,
+    'scale-free': scale_free,
+}
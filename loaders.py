@@ -0,0 +1,147 @@
+"""Loading of graphs from files, without building Python objects
+for each node or edge.
+
+Supported formats, chosen by file extension:
+
+- .csv, .tsv, .txt: one point (x, y, z) or one edge (x, y, z, x, y, z) per line,
+  read by chunks of lines, after an optional header line of column names.
+- .npy: (N, 3) array of points, opened with memory mapping.
+- .raw, .f32, .bin: raw little-endian float32 x, y, z triplets, opened with memory mapping.
+
+Links between points are given by a separate file of node indexes pairs,
+either as .npy (E, 2) integer array or as text with two indexes per line.
+
+"""
+
+import os
+import itertools
+
+import numpy as np
+
+import graph as graph_module
+from graph import ArrayGraph
+
+
+CHUNK_SIZE = 1 << 16  # number of lines or points handled at once
+TEXT_EXTENSIONS = {'.csv': ',', '.tsv': '\t', '.txt': None}
+RAW_EXTENSIONS = {'.raw', '.f32', '.bin'}
+
+
+class Bounds:
+    """Minimal and maximal coords of points, updated chunk by chunk"""
+
+    def __init__(self, dimension:int=3):
+        self.mins = np.full(dimension, np.inf)
+        self.maxs = np.full(dimension, -np.inf)
+
+    def update(self, points:np.ndarray):
+        if len(points):
+            np.minimum(self.mins, points.min(axis=0), out=self.mins)
+            np.maximum(self.maxs, points.max(axis=0), out=self.maxs)
+
+    @property
+    def bounds(self) -> (np.ndarray, np.ndarray):
+        return self.mins, self.maxs
+
+
+def load(fname:str, links_fname:str=None, chunk_size:int=CHUNK_SIZE) -> ArrayGraph:
+    """Return the graph described by given file(s), according to their extension"""
+    ext = os.path.splitext(fname)[1].lower()
+    if ext == '.npy':
+        return load_npy(fname, links_fname, chunk_size=chunk_size)
+    if ext in RAW_EXTENSIONS:
+        return load_raw_float32(fname, links_fname, chunk_size=chunk_size)
+    if ext in TEXT_EXTENSIONS:
+        return load_text(fname, links_fname, delimiter=TEXT_EXTENSIONS[ext], chunk_size=chunk_size)
+    raise ValueError("Unknown graph file format: {}".format(fname))
+
+
+def load_text(fname:str, links_fname:str=None, delimiter:str=None,
+              chunk_size:int=CHUNK_SIZE) -> ArrayGraph:
+    """Return the graph described by given text file of points (3 columns)
+    or edges (6 columns)"""
+    bounds = Bounds()
+    chunks, ncols = [], None
+    for chunk in iter_text_chunks(fname, delimiter=delimiter, chunk_size=chunk_size):
+        if ncols is None:  # the first chunk gives the format of the whole file
+            ncols = chunk.shape[1]
+            if ncols not in {3, 6}:
+                raise ValueError("Expected 3 or 6 columns in {}, not {}".format(fname, ncols))
+        elif chunk.shape[1] != ncols:
+            raise ValueError("Expected {} columns in all lines of {}, not {}".format(
+                ncols, fname, chunk.shape[1]))
+        chunk = chunk.reshape(-1, 3)  # edges are pairs of consecutive points
+        bounds.update(chunk)
+        chunks.append(chunk)
+    if not chunks:
+        raise ValueError("No point found in {}".format(fname))
+    points = np.concatenate(chunks)
+    if ncols == 6:
+        if links_fname:
+            raise ValueError("Links are already given by edge list {}".format(fname))
+        nodes, indexes = np.unique(points, axis=0, return_inverse=True)
+        return graph_module.array_graph(nodes, indexes.reshape(-1, 2), bounds=bounds.bounds)
+    return graph_module.array_graph(points, load_links(links_fname), bounds=bounds.bounds)
+
+
+def load_npy(fname:str, links_fname:str=None, chunk_size:int=CHUNK_SIZE) -> ArrayGraph:
+    """Return the graph of (N, 3) points stored in given .npy file,
+    which is memory mapped, not read in memory"""
+    nodes = np.load(fname, mmap_mode='r').reshape(-1, 3)
+    return graph_module.array_graph(nodes, load_links(links_fname),
+                                    bounds=bounds_of(nodes, chunk_size).bounds)
+
+
+def load_raw_float32(fname:str, links_fname:str=None, chunk_size:int=CHUNK_SIZE) -> ArrayGraph:
+    """Return the graph of points stored as raw float32 triplets in given file,
+    which is memory mapped, not read in memory"""
+    nodes = np.memmap(fname, dtype='<f4', mode='r').reshape(-1, 3)
+    return graph_module.array_graph(nodes, load_links(links_fname),
+                                    bounds=bounds_of(nodes, chunk_size).bounds)
+
+
+def load_links(fname:str or None, chunk_size:int=CHUNK_SIZE) -> np.ndarray:
+    """Return the (E, 2) array of node indexes pairs stored in given
+    .npy or text file, or an empty array if no file is given"""
+    if fname is None:
+        return np.empty((0, 2), dtype=np.intp)
+    ext = os.path.splitext(fname)[1].lower()
+    if ext == '.npy':
+        return np.load(fname, mmap_mode='r').reshape(-1, 2)
+    chunks = list(iter_text_chunks(fname, delimiter=TEXT_EXTENSIONS.get(ext),
+                                   chunk_size=chunk_size, dtype=np.intp))
+    return np.concatenate(chunks).reshape(-1, 2) if chunks else np.empty((0, 2), dtype=np.intp)
+
+
+def bounds_of(points:np.ndarray, chunk_size:int=CHUNK_SIZE) -> Bounds:
+    """Return the Bounds of given points, read chunk by chunk"""
+    bounds = Bounds(points.shape[1])
+    for first in range(0, len(points), chunk_size):
+        bounds.update(np.asarray(points[first:first+chunk_size], dtype=float))
+    return bounds
+
+
+def iter_text_chunks(fname:str, delimiter:str=None, chunk_size:int=CHUNK_SIZE,
+                     dtype:type=float) -> np.ndarray:
+    """Yield 2D arrays of values found in given text file, chunk_size lines at once.
+    Empty lines, lines starting with # and a first line that is not numbers
+    (a header of column names) are ignored."""
+    with open(fname) as fd:
+        lines = (line for line in fd if line.strip() and not line.lstrip().startswith('#'))
+        first = next(lines, None)
+        if first is not None and not _is_header(first, delimiter):
+            lines = itertools.chain((first,), lines)
+        while True:
+            chunk = tuple(itertools.islice(lines, chunk_size))
+            if not chunk:
+                break
+            yield np.loadtxt(chunk, delimiter=delimiter, dtype=dtype, ndmin=2)
+
+
+def _is_header(line:str, delimiter:str=None) -> bool:
+    """Return True if given line holds something else than numbers"""
+    try:
+        np.loadtxt((line,), delimiter=delimiter, ndmin=2)
+    except ValueError:
+        return True
+    return False
@@ -5,20 +5,30 @@ x and y are the 2D dimension. z is the depth.
 """
 
 import math
+import logging
 from collections import namedtuple
+
+import numpy as np
+
 import geometry
 from geometry import angles_from_coords
 
 
+LOGGER = logging.getLogger(__name__)
 POV_WIDTH = 90
 Coords = namedtuple('Coords', 'x, y, z')
 Coords2D = namedtuple('Coords2D', 'x, y')
-POV = namedtuple('POV', 'coords, rotation, width, height')
+NEAR = 0.1
+POV = namedtuple('POV', 'coords, rotation, width, height, model, near, far',
+                 defaults=('angle', NEAR, math.inf))
 # coords: a Coords instance, position of the observer in the world
 # orientation: angle in degree between the view axis and the x axis
 # elevation: angle in degree between the view axis and the y axis
 # width: angle in degree of the view from the x axis
 # height: angle in degree of the view from the y axis
+# model: 'angle' to place dots on screen according to their angle with the view axis,
+#  or 'pinhole' for a perspective projection by a view-projection matrix
+# near, far: distances along the view axis between which dots are visible, for pinhole model
 Projection = namedtuple('Projection', 'node, position, angles')
 # node: the projected object
 # position: Coords2D, that are the position of the node on-screen
@@ -26,26 +36,29 @@ Projection = namedtuple('Projection', 'node, position, angles')
 
 
 def projection(global_coords:(float, float, float), pov:POV, dot_radius:float=10,
-               verbose:bool=True) -> (float, float) or None:
+               verbose:bool=False) -> (float, float) or None:
     """Return (x, y, radius) of dot in 2D space for given POV, coords of the dot
     and its radius.
 
     If the dot is not in the POV field of view, returns None.
+    If verbose, details of the computation are logged as debug messages.
 
     """
+    if pov.model == 'pinhole':
+        projections, visible = project_many(np.array((global_coords,), dtype=float), pov, dot_radius)
+        if verbose:
+            LOGGER.debug('PINHOLE PROJECTION: %s %s %s', pov, global_coords, projections[0])
+        return tuple(projections[0].tolist()) if visible[0] else None
     # pov is aligned with x axis and system origin
     coords = geometry.coords_in_system(global_coords, pov.coords, pov.rotation)
     if verbose:
-        print()
-        print('POV:', pov)
-        print('GLOBAL COORDS:', global_coords)
-        print('COORDS:', coords)
+        LOGGER.debug('POV: %s', pov)
+        LOGGER.debug('GLOBAL COORDS: %s', global_coords)
+        LOGGER.debug('COORDS: %s', coords)
     distance = geometry.distance_to_origin(coords)
     x_angle_with_origin, y_angle_with_origin, z_angle_with_origin = angles_from_coords(coords)
     if verbose:
-        print('ANGLES:', x_angle_with_origin, y_angle_with_origin, z_angle_with_origin)
-    _global_dist_ = geometry.distance_between(global_coords, pov.coords)
-    # assert distance == _global_dist_, "{} and {} are not equal".format(distance, _global_dist_)
+        LOGGER.debug('ANGLES: %s %s %s', x_angle_with_origin, y_angle_with_origin, z_angle_with_origin)
 
     # determine if the object is in field of view for the x axis
     min_angle_x = -pov.width/2
@@ -54,7 +67,7 @@ def projection(global_coords:(float, float, float), pov:POV, dot_radius:float=10
         pass  # the object is printable in x
     else:  # the object is out of the field of view
         if verbose:
-            print('X-OUT:', min_angle_x, x_angle_with_origin, max_angle_x)
+            LOGGER.debug('X-OUT: %s %s %s', min_angle_x, x_angle_with_origin, max_angle_x)
         return None
 
     # determine if the object is in field of view for the y axis
@@ -64,7 +77,7 @@ def projection(global_coords:(float, float, float), pov:POV, dot_radius:float=10
         pass  # the object is printable in y
     else:  # the object is out of the field of view
         if verbose:
-            print('Y-OUT:', min_angle_y, y_angle_with_origin, max_angle_y)
+            LOGGER.debug('Y-OUT: %s %s %s', min_angle_y, y_angle_with_origin, max_angle_y)
         return None
 
     # Determine the x coord of the object in the projection
@@ -72,15 +85,106 @@ def projection(global_coords:(float, float, float), pov:POV, dot_radius:float=10
     proj_y = (y_angle_with_origin - min_angle_y) / (max_angle_y - min_angle_y)
     size = (1/distance) * dot_radius
     if verbose:
-        print('NODE PROJECTIONS:', proj_x, proj_y, '\tsize:', size, '\tdistance:', distance, end='\n\n')
+        LOGGER.debug('NODE PROJECTIONS: %s %s\tsize: %s\tdistance: %s', proj_x, proj_y, size, distance)
     return proj_x, proj_y, size
 
 
+def project_many(points:np.ndarray, pov:POV, dot_radius:float=10) -> (np.ndarray, np.ndarray):
+    """Vectorized version of projection, working on a (N, 3) array of coords.
+
+    Return the (N, 3) array of (x, y, radius) of dots in 2D space,
+    and the (N,) boolean mask of dots that are in the POV field of view.
+    Values of dots out of the field of view are meaningless.
+
+    """
+    if pov.model == 'pinhole':
+        matrix = view_projection(pov)
+        coords = np.asarray(points, dtype=float) @ matrix[:, :3].T + matrix[:, 3]
+        return _project_homogeneous(coords, pov.near, pov.far, dot_radius)
+    coords = geometry.coords_in_system_many(points, pov.coords, pov.rotation)
+    return _project_coords(coords, pov.width, pov.height, dot_radius)
+
+
+def project_orbit(points:np.ndarray, povs:[POV], dot_radius:float=10) -> (np.ndarray, np.ndarray):
+    """Project the (N, 3) array of coords for each of the F given POVs at once.
+
+    Return the (F, N, 3) array of (x, y, radius) of dots in 2D space,
+    and the (F, N) boolean mask of dots that are in the field of view,
+    so that project_orbit(points, povs)[i] equals project_many(points, povs[i]).
+
+    """
+    points = np.asarray(points, dtype=float)
+    models = {pov.model for pov in povs}
+    if models == {'pinhole'}:
+        matrices = np.stack([view_projection(pov) for pov in povs])
+        coords = points @ matrices[:, :, :3].transpose(0, 2, 1) + matrices[:, np.newaxis, :, 3]
+        nears = np.array([pov.near for pov in povs], dtype=float)[:, np.newaxis]
+        fars = np.array([pov.far for pov in povs], dtype=float)[:, np.newaxis]
+        return _project_homogeneous(coords, nears, fars, dot_radius)
+    if models != {'angle'}:  # mixed models are projected frame by frame
+        frames = [project_many(points, pov, dot_radius) for pov in povs]
+        return (np.stack([projections for projections, _ in frames]).reshape(len(povs), len(points), 3),
+                np.stack([visible for _, visible in frames]).reshape(len(povs), len(points)))
+    matrices = np.stack([
+        geometry.Transform.system(pov.coords, pov.rotation).matrix
+        for pov in povs
+    ])
+    # broadcast matrix product, faster than the equivalent einsum
+    coords = points @ matrices[:, :3, :3].transpose(0, 2, 1) + matrices[:, np.newaxis, :3, 3]
+    widths = np.array([pov.width for pov in povs], dtype=float)[:, np.newaxis]
+    heights = np.array([pov.height for pov in povs], dtype=float)[:, np.newaxis]
+    return _project_coords(coords, widths, heights, dot_radius)
+
+
+def view_projection(pov:POV) -> np.ndarray:
+    """Return the 4x4 matrix projecting homogeneous world coords
+    for given pinhole POV (see geometry.Transform.perspective)"""
+    return (geometry.Transform.perspective(pov.width, pov.height, pov.near, pov.far)
+            @ geometry.Transform.system(pov.coords, pov.rotation)).matrix
+
+
+def _project_homogeneous(coords:np.ndarray, near:float, far:float,
+                         dot_radius:float) -> (np.ndarray, np.ndarray):
+    """Project given (..., 4) homogeneous coords given by view_projection.
+    Near and far may be arrays broadcastable to coords.shape[:-1]."""
+    depth = coords[..., 3]
+    projections = np.empty(coords.shape[:-1] + (3,))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inverse_depth = 1 / depth
+        projections[..., 0] = coords[..., 0] * inverse_depth
+        projections[..., 1] = coords[..., 1] * inverse_depth
+        projections[..., 2] = inverse_depth * dot_radius
+    visible = ((near <= depth) & (depth <= far)
+               & (0 <= projections[..., 0]) & (projections[..., 0] <= 1)
+               & (0 <= projections[..., 1]) & (projections[..., 1] <= 1))
+    return projections, visible
+
+
+def _project_coords(coords:np.ndarray, width:float, height:float,
+                    dot_radius:float) -> (np.ndarray, np.ndarray):
+    """Project given coords, already in the POV coordinate system.
+    Width and height may be arrays broadcastable to coords.shape[:-1]."""
+    angles, distance = geometry.angles_from_coords_many(coords)
+    x_angle_with_origin, y_angle_with_origin = angles[..., 0], angles[..., 1]
+
+    min_angle_x, max_angle_x = -width/2, width/2
+    min_angle_y, max_angle_y = -height/2 + 90, height/2 + 90
+    visible = ((min_angle_x <= x_angle_with_origin) & (x_angle_with_origin <= max_angle_x)
+               & (min_angle_y <= y_angle_with_origin) & (y_angle_with_origin <= max_angle_y))
+
+    projections = np.empty_like(coords)
+    projections[..., 0] = (x_angle_with_origin - min_angle_x) / (max_angle_x - min_angle_x)
+    projections[..., 1] = (y_angle_with_origin - min_angle_y) / (max_angle_y - min_angle_y)
+    with np.errstate(divide='ignore'):
+        projections[..., 2] = (1/distance) * dot_radius
+    return projections, visible
+
+
 def create_pov_toward(global_coords:Coords, pov_coords:Coords) -> POV:
     """Return a POV that is directed toward given global coords and placed at given coords"""
     relative_coords = geometry.coords_centered_on(global_coords, pov_coords)
     angles = geometry.angles_from_coords(relative_coords)
-    print('ANGLES:', angles)
+    LOGGER.debug('ANGLES: %s', angles)
     rotation = Coords(
         0,  # camera is straight up, not upside-down or left-right or whatever
         0,  # camera is face to the x axis, so no rotation here
@@ -88,8 +192,8 @@ def create_pov_toward(global_coords:Coords, pov_coords:Coords) -> POV:
     )
     # rotation = angles
 
-    print('GLOBAL:', global_coords)
-    print('ROTATION:', rotation)
+    LOGGER.debug('GLOBAL: %s', global_coords)
+    LOGGER.debug('ROTATION: %s', rotation)
     return POV(
         Coords(*pov_coords),
         Coords(*rotation),
@@ -97,6 +201,27 @@ def create_pov_toward(global_coords:Coords, pov_coords:Coords) -> POV:
     )
 
 
+def pinhole_pov(pov_coords:Coords, rotation:Coords, fov:float=POV_WIDTH, aspect:float=1.,
+                near:float=NEAR, far:float=math.inf) -> POV:
+    """Return a pinhole POV of given vertical field of view (in degrees)
+    and aspect ratio, that is the ratio of screen width over screen height"""
+    width = math.degrees(2 * math.atan(aspect * math.tan(math.radians(fov) / 2)))
+    return POV(Coords(*pov_coords), Coords(*rotation), width, fov, 'pinhole', near, far)
+
+
+def pov_looking_at(target:Coords, pov_coords:Coords, width:float=POV_WIDTH,
+                   height:float=POV_WIDTH) -> POV:
+    """Return a POV placed at given coords, with its view axis going through
+    given target, that is then projected at the center of the screen"""
+    vx, vy, vz = (t - p for t, p in zip(target, pov_coords))
+    rotation = Coords(
+        0,  # camera is straight up
+        math.degrees(math.atan2(-vz, vx)),  # view axis brought in the (x, y) plane
+        math.degrees(math.atan2(-vy, math.hypot(vx, vz))),  # then onto the x axis
+    )
+    return POV(Coords(*pov_coords), rotation, width, height)
+
+
 
 if __name__ == "__main__":
     pov = POV(Coords(0, 0, 0), (0, 0, 0), 45, 45)
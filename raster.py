@@ -0,0 +1,282 @@
+"""Rasterizers drawing projected graphs into RGBA images.
+
+Two backends share the same interface:
+
+- PILRasterizer draws each primitive with PIL's ImageDraw. It is the reference.
+- NumpyRasterizer draws all primitives at once in a uint8 RGBA array,
+  reproducing PIL's rasterization (truncated coordinates, Bresenham lines
+  including their last point, rectangles including their borders),
+  so both backends give the same pixels.
+  It can also draw antialiased lines, and hide farther primitives
+  behind nearer ones with a depth buffer.
+
+Primitives are given as arrays, in pixel coordinates.
+
+"""
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+
+WHITE, RED, BLACK = (255, 255, 255, 255), (255, 0, 0, 255), (0, 0, 0, 255)
+BATCH_PIXELS = 1 << 22  # maximal number of pixels generated at once by NumpyRasterizer
+
+
+class PILRasterizer:
+    """Draw primitives one by one with PIL's ImageDraw"""
+
+    def __init__(self, width:int, height:int, background:(int, int, int, int)=BLACK,
+                 antialias:bool=False, depth_test:bool=False):
+        if antialias or depth_test:
+            raise ValueError("Antialiasing and depth test are only available with the numpy rasterizer")
+        self.width, self.height = width, height
+        self.im = Image.new('RGBA', (width, height), tuple(background))
+        self.draw = ImageDraw.Draw(self.im)
+
+    def draw_lines(self, segments:np.ndarray, color:(int, int, int, int)=WHITE, depths:np.ndarray=None):
+        """Draw the (K, 2, 2) segments, given as pairs of (x, y)"""
+        color = tuple(color)
+        for (sx, sy), (tx, ty) in np.asarray(segments, dtype=float).reshape(-1, 2, 2).tolist():
+            self.draw.line(((sx, sy), (tx, ty)), fill=color)
+
+    def draw_squares(self, positions:np.ndarray, sizes:np.ndarray, colors:np.ndarray,
+                     depths:np.ndarray=None):
+        """Draw squares of given (M,) sizes centered on the (M, 2) positions,
+        with given (M, 4) RGBA colors or a single one"""
+        colors = np.broadcast_to(colors, (len(positions), 4)).tolist()
+        for (x, y), size, color in zip(np.asarray(positions).tolist(), np.asarray(sizes).tolist(), colors):
+            self.draw.rectangle((x-size/2, y-size/2, x+size/2, y+size/2), fill=tuple(color))
+
+    def draw_density(self, positions:np.ndarray, weights:np.ndarray, cell:int):
+        """Fill the cells of given size in pixels that hold some of the
+        (N, 2) positions, as bright as the sum of their weights (see density_cells)"""
+        pixels = self.array()
+        filled, values = density_cells(self.width, self.height, cell, positions, weights)
+        pixels[filled, :3] = values[:, np.newaxis]
+        pixels[filled, 3] = 255
+        self.im = Image.fromarray(pixels, 'RGBA')
+        self.draw = ImageDraw.Draw(self.im)
+
+    def array(self) -> np.ndarray:
+        return np.array(self.im)
+
+    def image(self) -> Image:
+        return self.im
+
+
+class NumpyRasterizer:
+    """Draw primitives by batches in a preallocated (height, width, 4) uint8 array.
+
+    With depth test, primitives are given with a depth, and each pixel keeps
+    the color of the nearest one, whatever the drawing order.
+    Depths are inverse distances: the greater, the nearer.
+
+    Origin is the position of the top-left pixel in a bigger image, so that
+    a part of that image is drawn with the same pixels as the whole image
+    (density cells excepted).
+
+    """
+
+    def __init__(self, width:int, height:int, background:(int, int, int, int)=BLACK,
+                 antialias:bool=False, depth_test:bool=False, origin:(int, int)=(0, 0)):
+        self.width, self.height = width, height
+        self.origin = np.array(origin, dtype=np.int64)
+        self.antialias = antialias
+        self.pixels = np.empty((height, width, 4), dtype=np.uint8)
+        self.pixels[...] = background
+        self.flat = self.pixels.view(np.uint32).reshape(-1)  # one item per RGBA pixel
+        self.depth = np.full(width * height, -np.inf) if depth_test else None
+
+    def _write(self, positions:np.ndarray, colors:np.ndarray, depths:np.ndarray=None):
+        """Write packed colors at given flat positions, if they pass the depth test"""
+        if self.depth is None or depths is None:
+            self.flat[positions] = colors
+            return
+        np.maximum.at(self.depth, positions, depths)
+        front = depths >= self.depth[positions]
+        self.flat[positions[front]] = colors[front] if np.ndim(colors) else colors
+
+    def draw_lines(self, segments:np.ndarray, color:(int, int, int, int)=WHITE, depths:np.ndarray=None):
+        """Draw the (K, 2, 2) segments, given as pairs of (x, y).
+
+        With depth test, depths of the (K, 2) ends are given,
+        and interpolated along the lines.
+
+        """
+        segments = np.asarray(segments, dtype=float).reshape(-1, 2, 2)
+        if depths is not None:
+            depths = np.asarray(depths, dtype=float).reshape(-1, 2)
+        if self.antialias:
+            return self._draw_antialiased_lines(segments - self.origin, color,
+                                                None if self.depth is None else depths)
+        value = _packed(color)
+        ends = np.trunc(segments).astype(np.int64) - self.origin
+        if depths is not None:
+            lengths = np.maximum(np.abs(ends[:, 1] - ends[:, 0]).max(axis=1), 1)
+        for lines, xs, ys, step in bresenham(ends):
+            inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+            line_depths = None
+            if depths is not None:
+                lines = lines[inside]
+                ratio = step / lengths[lines]
+                line_depths = depths[lines, 0] + (depths[lines, 1] - depths[lines, 0]) * ratio
+            self._write((ys * self.width + xs)[inside], value, line_depths)
+
+    def _draw_antialiased_lines(self, segments:np.ndarray, color:(int, int, int, int),
+                                depths:np.ndarray=None):
+        """Draw lines with Xiaolin Wu's algorithm: the two pixels around
+        the line at each step along the major axis share its intensity.
+
+        With depths, each pixel is blended only if the nearest line covering it
+        passes the depth test, and its depth is written only if it is covered
+        by half or more, so that a faint line edge doesn't hide what is behind.
+
+        """
+        deltas = segments[:, 1] - segments[:, 0]
+        steps = np.ceil(np.abs(deltas).max(axis=1)).astype(np.int64) + 1
+        coverage = np.zeros((self.height, self.width))
+        if depths is not None:
+            line_depth = np.full((self.height, self.width), -np.inf)
+        for batch in _batches(steps):
+            nb_steps = steps[batch]
+            segment = np.repeat(np.arange(len(nb_steps)), nb_steps)
+            ratio = (np.arange(nb_steps.sum()) - np.repeat(np.cumsum(nb_steps) - nb_steps, nb_steps)) \
+                / np.maximum(nb_steps - 1, 1)[segment]
+            points = segments[batch][segment, 0] + deltas[batch][segment] * ratio[:, np.newaxis]
+            x_major = np.abs(deltas[batch][segment, 0]) >= np.abs(deltas[batch][segment, 1])
+            # the minor coordinate is split between its two neighbor pixels
+            major = np.where(x_major, points[:, 0], points[:, 1])
+            minor = np.where(x_major, points[:, 1], points[:, 0])
+            major = np.floor(major + 0.5).astype(np.int64)
+            low = np.floor(minor).astype(np.int64)
+            frac = minor - low
+            for offset, intensity in ((0, 1 - frac), (1, frac)):
+                xs = np.where(x_major, major, low + offset)
+                ys = np.where(x_major, low + offset, major)
+                inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+                np.maximum.at(coverage, (ys[inside], xs[inside]), intensity[inside])
+                if depths is not None:
+                    line_depths = depths[batch][segment, 0] + (depths[batch][segment, 1]
+                                                               - depths[batch][segment, 0]) * ratio
+                    np.maximum.at(line_depth, (ys[inside], xs[inside]), line_depths[inside])
+        covered = coverage > 0
+        if depths is not None:
+            depth = self.depth.reshape(self.height, self.width)
+            covered &= line_depth >= depth
+            opaque = covered & (coverage >= 0.5)
+            depth[opaque] = line_depth[opaque]
+        blend = coverage[covered][:, np.newaxis]
+        self.pixels[covered] = np.round(self.pixels[covered] * (1 - blend)
+                                        + np.array(color) * blend).astype(np.uint8)
+
+    def draw_squares(self, positions:np.ndarray, sizes:np.ndarray, colors:np.ndarray,
+                     depths:np.ndarray=None):
+        """Draw squares of given (M,) sizes centered on the (M, 2) positions,
+        with given (M, 4) RGBA colors or a single one, and (M,) depths if depth test"""
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        half = np.asarray(sizes, dtype=float)[:, np.newaxis] / 2
+        colors = np.broadcast_to(np.asarray(colors, dtype=np.uint8), (len(positions), 4))
+        low = np.maximum(np.trunc(positions - half).astype(np.int64) - self.origin, 0)
+        high = np.minimum(np.trunc(positions + half).astype(np.int64) - self.origin,
+                          (self.width - 1, self.height - 1))
+        sides = np.maximum(high - low + 1, 0)
+        areas = sides[:, 0] * sides[:, 1]
+        for batch in _batches(areas):
+            nb_pixels = areas[batch]
+            square = np.repeat(np.arange(len(nb_pixels)), nb_pixels)
+            idx = np.arange(nb_pixels.sum()) - np.repeat(np.cumsum(nb_pixels) - nb_pixels, nb_pixels)
+            width = sides[batch][square, 0]
+            xs = low[batch][square, 0] + idx % width
+            ys = low[batch][square, 1] + idx // width
+            # later squares are drawn over former ones, as with repeated indexes
+            #  numpy assigns the last value
+            self._write(ys * self.width + xs, _packed(colors[batch])[square],
+                        None if depths is None else np.asarray(depths, dtype=float)[batch][square])
+
+    def draw_density(self, positions:np.ndarray, weights:np.ndarray, cell:int):
+        """Fill the cells of given size in pixels that hold some of the
+        (N, 2) positions, as bright as the sum of their weights (see density_cells)"""
+        filled, values = density_cells(self.width, self.height, cell, positions, weights)
+        self.pixels[filled, :3] = values[:, np.newaxis]
+        self.pixels[filled, 3] = 255
+
+    def array(self) -> np.ndarray:
+        return self.pixels
+
+    def image(self) -> Image:
+        return Image.fromarray(self.pixels, 'RGBA')
+
+
+RASTERIZERS = {'pil': PILRasterizer, 'numpy': NumpyRasterizer}
+
+
+def bresenham(ends:np.ndarray) -> iter:
+    """Yield pixels of lines between given (K, 2, 2) integer ends, as drawn by PIL:
+    last point included, and the major axis being y when both axis are as long.
+
+    Lines are drawn all at once, step by step along their major axis.
+    At each step are yielded the indexes of lines still being drawn,
+    the x and y of their pixel, and the number of the step.
+
+    """
+    starts, deltas = ends[:, 0], ends[:, 1] - ends[:, 0]
+    signs = np.where(deltas < 0, -1, 1)
+    dx, dy = np.abs(deltas).T
+    x_major = dx > dy
+    # lines sorted by decreasing length, so that lines drawn at each step are a prefix
+    order = np.argsort(-np.maximum(dx, dy), kind='stable')
+    major, minor = np.maximum(dx, dy)[order], np.minimum(dx, dy)[order]
+    x0, y0 = starts[order].T
+    sx, sy = signs[order].T
+    x_major = x_major[order]
+    # offsets of pixels at each step along the major axis, and the minor one
+    x_on_major, x_on_minor = np.where(x_major, sx, 0), np.where(x_major, 0, sx)
+    y_on_major, y_on_minor = np.where(x_major, 0, sy), np.where(x_major, sy, 0)
+    double_major, double_minor = np.maximum(2 * major, 1), 2 * minor
+    nb_lines = np.searchsorted(-major, -np.arange(major[0] + 1 if len(major) else 0), side='right')
+    for step, n in enumerate(nb_lines):
+        minor_step = (double_minor[:n] * step + major[:n]) // double_major[:n]
+        yield (order[:n],
+               x0[:n] + x_on_major[:n] * step + x_on_minor[:n] * minor_step,
+               y0[:n] + y_on_major[:n] * step + y_on_minor[:n] * minor_step,
+               step)
+
+
+def density_cells(width:int, height:int, cell:int, positions:np.ndarray,
+                  weights:np.ndarray) -> (np.ndarray, np.ndarray):
+    """Return the (height, width) mask of pixels in cells holding some of given positions,
+    and the uint8 value of these pixels, growing with the sum of weights in their cell
+    on a log scale, up to 255 for the heaviest cell"""
+    positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+    nb_x, nb_y = -(-width // cell), -(-height // cell)
+    cells_x = np.floor(positions[:, 0] / cell).astype(np.intp)
+    cells_y = np.floor(positions[:, 1] / cell).astype(np.intp)
+    inside = (cells_x >= 0) & (cells_x < nb_x) & (cells_y >= 0) & (cells_y < nb_y)
+    cells = cells_y[inside] * nb_x + cells_x[inside]
+    counts = np.bincount(cells, minlength=nb_x * nb_y).reshape(nb_y, nb_x)
+    density = np.bincount(cells, weights=np.asarray(weights, dtype=float)[inside],
+                          minlength=nb_x * nb_y).reshape(nb_y, nb_x)
+    # one value per cell, expanded to the pixels
+    filled = (counts > 0).repeat(cell, axis=0).repeat(cell, axis=1)[:height, :width]
+    density = np.log1p(density) / np.log1p(max(density.max(), 1e-12))
+    density = density.repeat(cell, axis=0).repeat(cell, axis=1)[:height, :width]
+    return filled, np.round(density[filled] * 255).astype(np.uint8)
+
+
+def _packed(colors:np.ndarray) -> np.ndarray:
+    """Return given RGBA color(s) as uint32, as found in the pixels flat view"""
+    return np.ascontiguousarray(colors, dtype=np.uint8).view(np.uint32).reshape(np.shape(colors)[:-1])
+
+
+def _batches(sizes:np.ndarray, limit:int=BATCH_PIXELS) -> [slice]:
+    """Yield slices of consecutive items whose sizes sum to about given limit"""
+    if not len(sizes):
+        return
+    bounds = np.searchsorted(np.cumsum(sizes), np.arange(limit, int(sizes.sum()) + limit, limit), side='right')
+    start = 0
+    for end in bounds:
+        end = max(int(end), start + 1)  # items bigger than the limit are alone in their batch
+        if start >= len(sizes):
+            break
+        yield slice(start, end)
+        start = end
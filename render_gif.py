@@ -4,20 +4,34 @@ Nodes are points in the 3D space.
 
 """
 
+import os
 import math
-import itertools
+import logging
+import tempfile
+import multiprocessing
 
-import imageio
-from PIL import Image, ImageDraw
+import imageio.v2 as imageio
+import numpy as np
+from PIL import Image, ImageDraw, GifImagePlugin
 
 import graph as graph_module
 from graph import Graph
 import geometry
 import projection
+import diagnostics
+import raster
+import cache as cache_module
+import spatial
+import loaders
 from projection import Coords, POV
 
 
+LOGGER = logging.getLogger(__name__)
 POV_WIDTH = 90
+GIF_TRANSPARENT = 255  # palette index of transparent pixels in delta gifs, when all 256 colors are used
+QUANTIZE_SAMPLE = 1 << 20  # number of pixels used to quantize the colors of delta gifs
+ORBIT_BATCH_BYTES = 1 << 26  # memory budget of the projections of a batch of orbit frames
+ORBIT_TEMPORARIES = 4  # number of (F, N, 3) float arrays alive while projecting an orbit batch
 
 
 def points_on_circle(center:(float, float), radius:float, nb_point:int=10) -> (float, float):
@@ -31,31 +45,71 @@ def points_on_circle(center:(float, float), radius:float, nb_point:int=10) -> (f
 
 
 def draw_3d_graph(graph:Graph, pov_coords:Coords, fname:str='graph.png',
-                  verbose:bool=True):
-    """Draw a projection of given graph"""
+                  verbose:bool=False, index:spatial.Octree=None,
+                  cache:cache_module.ProjectionCache=None, pov:POV=None,
+                  content_hash:str=None, **draw_options) -> str or np.ndarray:
+    """Draw a projection of given graph.
+
+    Return given fname, or the RGBA array of the image if fname is None.
+    The POV is placed at pov_coords and directed toward the graph center,
+    unless another POV is given.
+    If verbose, projections are logged as debug messages.
+    If a spatial index of the graph is given, nodes and links out of the field
+    of view are culled by the index before projection.
+    Otherwise, if a projection cache is given, projections are taken from it
+    when available. Giving the cache_module.graph_hash of the graph nodes
+    as content_hash avoids its computation at each call.
+    Draw options are given to draw_2d_graph.
+
+    """
     amplitudes, center = graph.amplitudes, graph.center
     pov_coords = Coords(*pov_coords)
-    pov = projection.create_pov_toward(center, pov_coords)
-    print('CENTER PROJECTION:', projection.projection(center, pov, verbose=verbose))
-    # exit()
-    if verbose:
-        print('POV:', pov)
-        # print('ANGLES OF CENTER:', geometry.angles_from_coords(geometry.coords_centered_on(center, pov.coords)))
-    nodes_projections = {
-        node: projection.projection(Coords(*node), pov, verbose=verbose)
-        for node in graph.nodes
-    }
+    if pov is None:
+        pov = projection.create_pov_toward(center, pov_coords)
+    with diagnostics.stage('projection'):
+        if index is None:
+            nodes, edges = graph_arrays(graph)
+        else:
+            candidates, edges = index.cull(pov)
+            nodes = index.nodes[candidates]
+        center_projection = projection.projection(center, pov, verbose=verbose)
+        if cache is None or index is not None:
+            projections, visible = projection.project_many(nodes, pov)
+        else:
+            projections, visible = cache.project_many(nodes, pov, content_hash=content_hash)
+    LOGGER.debug('CENTER PROJECTION: %s', center_projection)
     # draw_map(pov, nodes_projections, center, center)
-    if verbose:
-        print('NODES PROJECTIONS:', nodes_projections)
-    graph_2d = frozenset(
-        (nodes_projections[source], nodes_projections[target])
-        for source, target in graph.links
-        if nodes_projections[source] and nodes_projections[target]
-    )
-    if verbose:
-        print('2D GRAPH:', graph_2d)
-    draw_2d_graph(graph_2d, fname=fname, center=projection.projection(center, pov, verbose=verbose))
+    if verbose and LOGGER.isEnabledFor(logging.DEBUG):
+        LOGGER.debug('POV: %s', pov)
+        LOGGER.debug('NODES PROJECTIONS: %s', {
+            tuple(node): tuple(proj) if is_visible else None
+            for node, proj, is_visible in zip(nodes.tolist(), projections.tolist(), visible)
+        })
+    return draw_projected_graph(projections, visible, edges, fname=fname,
+                                center=center_projection, **draw_options)
+
+
+def graph_arrays(graph:Graph or graph_module.ArrayGraph) -> (np.ndarray, np.ndarray):
+    """Return the (N, 3) array of coords of the nodes of given graph,
+    and the (E, 2) array of indexes of the nodes of each link"""
+    graph = graph_module.as_array_graph(graph)
+    return graph.nodes, graph.links
+
+
+def draw_projected_graph(projections:np.ndarray, visible:np.ndarray, edges:np.ndarray,
+                         fname:str, center:(float, float, float)=None,
+                         **draw_options) -> str or np.ndarray:
+    """Draw the graph described by the (N, 3) projections of its nodes,
+    their (N,) visibility mask and the (E, 2) indexes of linked nodes.
+
+    Links are drawn only if both their nodes are visible.
+    Draw options are given to draw_2d_graph.
+
+    """
+    with diagnostics.stage('graph_2d'):
+        kept_edges = edges[visible[edges].all(axis=1)]
+        graph_2d = projections[kept_edges]
+    return draw_2d_graph(graph_2d, fname=fname, center=center, **draw_options)
 
 
 ITER = 0
@@ -119,58 +173,458 @@ def draw_map(pov:POV, projections:dict, center:Coords, relative_center:Coords,
 
 def draw_2d_graph(graph:[(float, float, float), (float, float, float)],
                   fname:str, width:int=400, height:int=400,
-                  nodes_color:dict={}, center:(float, float, float)=None):
+                  nodes_color:dict={}, center:(float, float, float)=None,
+                  lod_cell:int=None, backend:str='pil', antialias:bool=False,
+                  depth_test:bool=False) -> str or np.ndarray:
     """
 
     Nodes are represented by 3 values: x position, y position and size.
+    Graph is an iterable of pairs of nodes, or a (E, 2, 3) array.
 
-    """
-    im = Image.new('RGBA', (width, height), 'black')
-    draw = ImageDraw.Draw(im)
-    # draw the edges
-    scaled_graph = frozenset((
-        ((sx*width, sy*height, st+1), (tx*width, ty*height, tt+1))
-        for (sx, sy, st), (tx, ty, tt) in graph
-    ))
+    The image is saved in given fname, that is returned.
+    If fname is None, the image is not saved, and its (height, width, 4)
+    RGBA array is returned instead.
+
+    If lod_cell is given, the nodes are drawn with a level of detail of
+    lod_cell pixels: nodes are binned in a grid of lod_cell × lod_cell pixels cells,
+    and each cell is drawn once, brighter as it holds more nodes (on a log scale,
+    the most populated cell being white).
+    Edges shorter than lod_cell pixels count as a node in the cell of their middle,
+    instead of being drawn.
 
-    for (sx, sy, _), (tx, ty, _) in scaled_graph:  # source and target's x, y and size
-        # print('EWFDZM:', sx, sy, tx, ty)
-        draw.line(((sx, sy), (tx, ty)), fill='white')
+    Backend is the name of the rasterizer drawing the image (see raster.RASTERIZERS).
+    Antialiasing of edges is only available with the numpy backend.
 
-    # draw the stars
-    nodes = frozenset(itertools.chain.from_iterable(scaled_graph))
-    for x, y, size in nodes:
-        color = [int(size * 255)] * 3 + [255]
-        draw.rectangle((x-size/2, y-size/2, x+size/2, y+size/2), fill=tuple(color))
+    With depth test (numpy backend only), nearer nodes and edges hide farther ones,
+    instead of being drawn in the graph order. The depth of nodes is given by their
+    size, that is inversely proportional to their distance, and interpolated along edges.
+    Level of detail cells are drawn without depth test.
+
+    """
+    with diagnostics.stage('rasterize'):
+        rasterizer = raster.RASTERIZERS[backend](width, height, antialias=antialias,
+                                                 depth_test=depth_test)
+        segments = np.asarray(graph if isinstance(graph, np.ndarray) else list(graph),
+                              dtype=float).reshape(-1, 2, 3)
+        scaled_graph = segments * (width, height, 1) + (0, 0, 1)
+        if lod_cell:
+            lengths = np.hypot(*(scaled_graph[:, 1, :2] - scaled_graph[:, 0, :2]).T)
+            short_edges = scaled_graph[lengths < lod_cell]
+            scaled_graph = scaled_graph[lengths >= lod_cell]
+
+        # draw the edges
+        rasterizer.draw_lines(scaled_graph[:, :, :2], raster.WHITE,
+                              depths=scaled_graph[:, :, 2] if depth_test else None)
+
+        # draw the stars
+        nodes = np.unique(scaled_graph.reshape(-1, 3), axis=0)
+        if lod_cell:
+            short_middles = short_edges[:, :, :2].mean(axis=1)
+            rasterizer.draw_density(np.concatenate((nodes[:, :2], short_middles)),
+                                    np.ones(len(nodes) + len(short_middles)), lod_cell)
+        else:
+            rasterizer.draw_squares(nodes[:, :2], nodes[:, 2], star_colors(nodes[:, 2]),
+                                    depths=nodes[:, 2] if depth_test else None)
+
+        # draw the center
+        if center:
+            x, y, size = center
+            rasterizer.draw_squares(((x * width, y * height),), (size,), raster.RED)
+
+    with diagnostics.stage('encode'):
+        if fname is None:
+            return rasterizer.array()
+        rasterizer.image().save(fname)
+        return fname
+
+
+def draw_views(graph:Graph, povs:[POV], fname_template:str=None,
+               index:spatial.Octree=None, **draw_options) -> [str or np.ndarray]:
+    """Return the images of given graph seen from each of given POVs,
+    as filenames made from fname_template, or RGBA arrays if it is None.
+
+    Nodes and links are prepared once for all views, and projected
+    for all views in a single pass. If a spatial index of the graph is given,
+    nodes out of the field of view of all POVs are culled first.
+    Draw options are given to draw_2d_graph.
+    See tile_frames to gather the images in a single one.
+
+    """
+    with diagnostics.stage('projection'):
+        if index is None:
+            nodes, edges = graph_arrays(graph)
+        else:
+            candidates, edges = index.cull_many(povs)
+            nodes = index.nodes[candidates]
+        nodes = np.vstack((nodes, [graph.center]))  # center is projected as the last node
+        projections, visible = projection.project_orbit(nodes, povs)
+    images = []
+    for n, (frame, frame_visible) in enumerate(zip(projections, visible), start=1):
+        with diagnostics.frame(n):
+            images.append(_draw_orbit_frame(frame, frame_visible, edges,
+                                            _frame_fname(fname_template, n), draw_options))
+    return images
+
+
+def tile_frames(frames, columns:int=None, fname:str=None,
+                background:(int, int, int, int)=raster.BLACK) -> str or np.ndarray:
+    """Return the image made of given frames (filenames or RGBA arrays of the same shape)
+    placed on a grid of given number of columns, by default as square as possible.
+
+    The image is saved in given fname, that is returned.
+    If fname is None, the RGBA array of the image is returned instead.
 
-    # draw the center
-    if center:
-        x, y, size = center
-        x *= width
-        y *= height
-        draw.rectangle((x-size/2, y-size/2, x+size/2, y+size/2), fill='red')
+    """
+    frames = [imageio.imread(frame) if isinstance(frame, str) else frame for frame in frames]
+    columns = columns or math.ceil(math.sqrt(len(frames)))
+    rows = math.ceil(len(frames) / columns)
+    height, width = frames[0].shape[:2]
+    with diagnostics.stage('encode'):
+        tiled = np.empty((rows * height, columns * width, 4), dtype=np.uint8)
+        tiled[...] = background
+        for idx, frame in enumerate(frames):
+            row, column = divmod(idx, columns)
+            tiled[row*height:(row+1)*height, column*width:(column+1)*width] = frame
+        if fname is None:
+            return tiled
+        Image.fromarray(tiled).save(fname)
+        return fname
+
+
+def star_colors(sizes:np.ndarray) -> np.ndarray:
+    """Return the (M, 4) RGBA colors of nodes of given sizes: the bigger, the brighter"""
+    colors = np.empty((len(sizes), 4), dtype=np.uint8)
+    colors[:, :3] = np.minimum((sizes * 255).astype(np.int64), 255)[:, np.newaxis]
+    colors[:, 3] = 255
+    return colors
+
+
+def draw_3d_graph_out_of_core(graph:graph_module.ArrayGraph, pov_coords:Coords, fname:str='graph.png',
+                              chunk_size:int=loaders.CHUNK_SIZE, workdir:str=None, pov:POV=None,
+                              width:int=400, height:int=400, backend:str='pil',
+                              antialias:bool=False, depth_test:bool=False) -> str or np.ndarray:
+    """Draw a projection of given graph as draw_3d_graph, holding at most
+    chunk_size nodes or links in memory at once, beside the image.
+
+    Nodes and links are typically memory mapped, as given by the loaders module.
+    Projections of the nodes are computed chunk by chunk into a temporary
+    memory mapped file of given workdir, then links are drawn chunk by chunk,
+    and finally the nodes having a drawn link.
+
+    The image is the same as the one of draw_3d_graph if the graph fits in a single chunk.
+    Otherwise, overlapping nodes may be drawn in another order, unless depth test is used.
 
-    im.save(fname)
+    """
+    graph = graph_module.as_array_graph(graph)
+    nodes, links = graph.nodes, graph.links
+    if pov is None:
+        pov = projection.create_pov_toward(graph.center, Coords(*pov_coords))
+    rasterizer = raster.RASTERIZERS[backend](width, height, antialias=antialias, depth_test=depth_test)
+    with tempfile.TemporaryDirectory(dir=workdir) as tmpdir:
+        projections = np.lib.format.open_memmap(os.path.join(tmpdir, 'projections.npy'), mode='w+',
+                                                dtype=float, shape=(len(nodes), 3))
+        visible = np.lib.format.open_memmap(os.path.join(tmpdir, 'visible.npy'), mode='w+',
+                                            dtype=bool, shape=(len(nodes),))
+        linked = np.lib.format.open_memmap(os.path.join(tmpdir, 'linked.npy'), mode='w+',
+                                           dtype=bool, shape=(len(nodes),))
+        with diagnostics.stage('projection'):
+            for first in range(0, len(nodes), chunk_size):
+                chunk = np.s_[first:first+chunk_size]
+                projections[chunk], visible[chunk] = projection.project_many(nodes[chunk], pov)
+            center = projection.projection(graph.center, pov)
+        with diagnostics.stage('rasterize'):
+            for first in range(0, len(links), chunk_size):
+                chunk_links = np.asarray(links[first:first+chunk_size])
+                chunk_links = chunk_links[visible[chunk_links].all(axis=1)]
+                linked[chunk_links.reshape(-1)] = True
+                segments = projections[chunk_links] * (width, height, 1) + (0, 0, 1)
+                rasterizer.draw_lines(segments[:, :, :2], raster.WHITE,
+                                      depths=segments[:, :, 2] if depth_test else None)
+            for first in range(0, len(nodes), chunk_size):
+                chunk = np.s_[first:first+chunk_size]
+                stars = np.unique(projections[chunk][linked[chunk]] * (width, height, 1) + (0, 0, 1), axis=0)
+                rasterizer.draw_squares(stars[:, :2], stars[:, 2], star_colors(stars[:, 2]),
+                                        depths=stars[:, 2] if depth_test else None)
+            if center:
+                x, y, size = center
+                rasterizer.draw_squares(((x * width, y * height),), (size,), raster.RED)
+        del projections, visible, linked  # close the memory maps before removing their files
+    with diagnostics.stage('encode'):
+        if fname is None:
+            return rasterizer.array()
+        rasterizer.image().save(fname)
+        return fname
 
 
 def run_things(graph, nb_point=100, distance_to_object_factor:float=4.7,
                fname_template:str='output/graph_{num:03d}.png',
-               verbose:bool=True):
-    dist_to_center = (max(graph.amplitudes[0], graph.amplitudes[2])/2) * distance_to_object_factor
-    points = points_on_circle((graph.center.x, graph.center.z), dist_to_center, nb_point=nb_point)
-    for n, (x, z) in enumerate(points, start=1):
-        print('CIRCLING BY:', x , z)
-        fname = fname_template.format(num=n)
-        draw_3d_graph(graph, pov_coords=Coords(x, graph.center.y, z),
-                      fname=fname, verbose=verbose)
-        yield fname
+               verbose:bool=False, orbit:bool=True, frames_per_batch:int=None,
+               workers:int=1, index:spatial.Octree=None,
+               cache:cache_module.ProjectionCache=None, povs:[POV]=None, **draw_options):
+    """Yield filenames of images showing the graph from points on a circle around it,
+    or from given POVs, for instance along a camera path (see camera.sample_povs).
+
+    If fname_template is None, no file is written, and RGBA arrays of the images
+    are yielded instead.
+
+    In orbit mode, the nodes are projected for batches of frames_per_batch frames
+    in a single vectorized pass each. As projecting F frames of N nodes takes about
+    F * N * 24 * ORBIT_TEMPORARIES bytes of memory, frames_per_batch defaults
+    to the number of frames fitting in ORBIT_BATCH_BYTES.
+
+    With more than one worker, frames are instead projected and drawn
+    by a pool of processes, and their filenames are yielded in order.
 
+    If a spatial index of the graph is given, frames are projected one by one,
+    each one only for the nodes not culled by the index, by the workers if any.
+
+    If a projection cache is given, projections of frames already rendered
+    are taken from it instead of being computed, except with more than one worker.
+
+    Draw options are given to draw_2d_graph.
+
+    """
+    if povs is None:
+        dist_to_center = (max(graph.amplitudes[0], graph.amplitudes[2])/2) * distance_to_object_factor
+        points = points_on_circle((graph.center.x, graph.center.z), dist_to_center, nb_point=nb_point)
+        povs = [projection.create_pov_toward(graph.center, Coords(x, graph.center.y, z))
+                for x, z in points]
+    if (not orbit or index is not None) and workers <= 1:
+        # the graph is hashed once for all frames
+        content_hash = None if cache is None or index is not None else cache_module.graph_hash(graph_arrays(graph)[0])
+        for n, pov in enumerate(povs, start=1):
+            LOGGER.debug('CIRCLING BY: %s', pov.coords)
+            with diagnostics.frame(n):
+                image = draw_3d_graph(graph, pov_coords=pov.coords, pov=pov,
+                                      fname=_frame_fname(fname_template, n), verbose=verbose,
+                                      index=index, cache=cache, content_hash=content_hash, **draw_options)
+            yield image
+        return
+
+    if workers > 1 and index is not None:  # the graph is given to workers by the index
+        nodes, edges = np.array([graph.center], dtype=float), None
+    else:
+        nodes, edges = graph_arrays(graph)
+        nodes = np.vstack((nodes, [graph.center]))  # center is projected as the last node
+    if workers > 1:
+        # the graph is given once to each worker, not pickled for each frame
+        with multiprocessing.Pool(workers, initializer=_init_frame_worker,
+                                  initargs=(nodes, edges, povs, fname_template, draw_options, index)) as pool:
+            chunksize = max(1, len(povs) // (workers * 4))
+            yield from pool.imap(_draw_frame_in_worker, range(len(povs)), chunksize=chunksize)
+        return
+
+    content_hash = None if cache is None else cache_module.graph_hash(nodes)
+    frames_per_batch = frames_per_batch or orbit_batch_size(len(nodes))
+    for first in range(0, len(povs), frames_per_batch):
+        batch = povs[first:first+frames_per_batch]
+        with diagnostics.frames(range(first + 1, first + 1 + len(batch))), diagnostics.stage('projection'):
+            projections, visible = _project_orbit(nodes, batch, cache, content_hash)
+        for n, (frame, frame_visible) in enumerate(zip(projections, visible), start=first+1):
+            with diagnostics.frame(n):
+                image = _draw_orbit_frame(frame, frame_visible, edges,
+                                          _frame_fname(fname_template, n), draw_options)
+            yield image
+
+
+def orbit_batch_size(nb_node:int, budget:int=ORBIT_BATCH_BYTES) -> int:
+    """Return the number of orbit frames of nb_node nodes projected at once
+    within given memory budget in bytes, at least one"""
+    return max(1, budget // (max(1, nb_node) * 24 * ORBIT_TEMPORARIES))
+
+
+def _project_orbit(nodes:np.ndarray, povs:[POV], cache:cache_module.ProjectionCache=None,
+                   content_hash:str=None) -> (np.ndarray, np.ndarray):
+    """Return projection.project_orbit(nodes, povs), with projections
+    taken from the cache if any, and missing ones computed in a single pass"""
+    if cache is None:
+        return projection.project_orbit(nodes, povs)
+    keys = [cache.key(content_hash, pov) for pov in povs]
+    frames = [cache.get(key) for key in keys]
+    missing = [idx for idx, frame in enumerate(frames) if frame is None]
+    if missing:
+        projections, visible = projection.project_orbit(nodes, [povs[idx] for idx in missing])
+        for idx, frame_projections, frame_visible in zip(missing, projections, visible):
+            cache.put(keys[idx], frame_projections, frame_visible)
+            frames[idx] = frame_projections, frame_visible
+    return np.stack([projections for projections, _ in frames]), np.stack([visible for _, visible in frames])
+
+
+def _frame_fname(fname_template:str or None, num:int) -> str or None:
+    return None if fname_template is None else fname_template.format(num=num)
+
+
+def _draw_orbit_frame(projections:np.ndarray, visible:np.ndarray, edges:np.ndarray,
+                      fname:str, draw_options:dict) -> str or np.ndarray:
+    """Draw a frame of run_things, where the center is the last projected node"""
+    center = tuple(projections[-1]) if visible[-1] else None
+    return draw_projected_graph(projections[:-1], visible[:-1], edges, fname=fname,
+                                center=center, **draw_options)
+
+
+_FRAME_WORKER_STATE = None  # (nodes, edges, povs, fname_template, draw_options, index) in pool workers
+
+def _init_frame_worker(nodes:np.ndarray, edges:np.ndarray, povs:[POV],
+                       fname_template:str, draw_options:dict, index:spatial.Octree=None):
+    global _FRAME_WORKER_STATE
+    _FRAME_WORKER_STATE = nodes, edges, povs, fname_template, draw_options, index
+
+def _draw_frame_in_worker(frame_index:int) -> str or np.ndarray:
+    """Draw a frame of run_things. With a spatial index, nodes only hold the center,
+    and the graph nodes not culled by the index are projected before it."""
+    nodes, edges, povs, fname_template, draw_options, index = _FRAME_WORKER_STATE
+    pov = povs[frame_index]
+    if index is not None:
+        candidates, edges = index.cull(pov)
+        nodes = np.vstack((np.asarray(index.nodes[candidates], dtype=float).reshape(-1, 3), nodes))
+    fname = _frame_fname(fname_template, frame_index + 1)
+    return _draw_orbit_frame(*projection.project_many(nodes, pov), edges, fname, draw_options)
+
+
+def write_gif(frames, duration:float=1, fname:str='graph.gif', delta:bool=False):
+    """Write given frames in a gif file.
+
+    Frames are either filenames of images, or RGBA arrays as yielded
+    by run_things when called without fname_template.
+
+    With delta, all frames share one global palette, and each frame
+    after the first only stores the rectangle of pixels that changed,
+    with unchanged pixels made transparent. Frames identical to the previous
+    one are merged into it. Frames are spilled to a temporary file rather
+    than kept in memory (see write_delta_gif).
+
+    Duration of frames is given in milliseconds, either for all frames
+    or for each one, as returned by camera.sample_povs.
 
-def write_gif(filenames, duration:float=1):
-    with imageio.get_writer('graph.gif', mode='I', duration=duration) as writer:
-        for filename in filenames:
-            image = imageio.imread(filename)
-            writer.append_data(image)
+    """
+    if delta:
+        return write_delta_gif(frames, duration=duration, fname=fname)
+    with imageio.get_writer(fname, mode='I', duration=duration) as writer:
+        for frame in frames:
+            with diagnostics.stage('encode'):
+                if isinstance(frame, str):
+                    frame = imageio.imread(frame)
+                writer.append_data(frame)
+
+
+def write_delta_gif(frames, duration:float=1, fname:str='graph.gif', workdir:str=None):
+    """Write given frames in a gif file with a global palette and delta frames.
+    See write_gif.
+
+    As the palette is computed before writing any frame, frames are read once,
+    packed as RGB, and spilled into a temporary file of given workdir,
+    so that only a couple of frames are held in memory at once.
+
+    """
+    with tempfile.TemporaryDirectory(dir=workdir) as tmpdir:
+        spill_fname, shapes = os.path.join(tmpdir, 'frames.rgb'), []
+        with open(spill_fname, 'wb') as spill:
+            def spilled(frames):
+                for frame in frames:
+                    packed = _packed_rgb(frame)
+                    packed.astype('<u4').tofile(spill)
+                    shapes.append(packed.shape)
+                    yield packed
+            with diagnostics.stage('encode'):
+                colors, indexes, palette = global_palette(spilled(frames))
+        if not shapes:
+            raise ValueError("No frame to write in {}".format(fname))
+        if len(set(shapes)) > 1:
+            raise ValueError("Frames of {} differ in size".format(fname))
+        height, width = shapes[0]
+        packed_frames = np.memmap(spill_fname, dtype='<u4', mode='r', shape=(len(shapes), height, width))
+        durations = np.broadcast_to(duration, len(shapes)).tolist()
+        _write_delta_frames(fname, packed_frames, durations, colors, indexes, palette)
+        del packed_frames  # close the memory map before removing its file
+
+
+def _write_delta_frames(fname:str, frames:np.ndarray, durations:[float], colors:np.ndarray,
+                        indexes:np.ndarray, palette:np.ndarray):
+    """Write given (F, H, W) packed RGB frames in a gif file, as delta frames
+    over the global palette given by global_palette"""
+    height, width = frames.shape[1:]
+    with open(fname, 'wb') as fd:
+        fd.write(b'GIF89a' + np.array((width, height), dtype='<u2').tobytes())
+        # global palette of 2**(n+1) colors, background, aspect
+        fd.write(bytes((0xF0 | (len(palette).bit_length() - 2), 0, 0)))
+        fd.write(palette.astype(np.uint8).tobytes())
+        transparent = len(palette) - 1
+        previous, pending = None, None  # indexed frame, and (image, offset, duration) not yet written
+        for frame, duration in zip(frames, durations):
+            with diagnostics.stage('encode'):
+                current = indexes[np.searchsorted(colors, frame)].astype(np.uint8)
+                if previous is None:
+                    changed, top, left = current, 0, 0
+                else:
+                    rows, cols = np.nonzero(current != previous)
+                    if not len(rows):  # nothing changed: previous frame lasts longer
+                        pending = pending[0], pending[1], pending[2] + duration
+                        continue
+                    top, left = rows.min(), cols.min()
+                    area = np.s_[top:rows.max()+1, left:cols.max()+1]
+                    changed = np.where(current[area] == previous[area], transparent, current[area])
+                if pending:
+                    _write_gif_frame(fd, *pending, transparent)
+                pending = Image.fromarray(changed.astype(np.uint8), mode='P'), (int(left), int(top)), duration
+                previous = current
+        _write_gif_frame(fd, *pending, transparent)
+        fd.write(b';')
+
+
+def global_palette(frames) -> (np.ndarray, np.ndarray, np.ndarray):
+    """Return the sorted colors found in given (H, W) packed RGB frames,
+    their index in the palette, and the (P, 3) palette.
+
+    If there is less than 256 colors, the palette holds them exactly,
+    and P is the smallest power of two holding them and one more color.
+    Else P is 256, and the palette is computed by PIL's quantization
+    of a sample of pixels. The last palette index is kept free for transparency.
+
+    Pixels are sampled as frames are read, one every stride pixels, and the stride
+    is doubled whenever the sample exceeds twice QUANTIZE_SAMPLE pixels,
+    so that the sample stays small whatever the number of frames.
+
+    """
+    colors, samples, nb_sampled, stride = np.empty(0, dtype=np.uint32), [], 0, 1
+    for frame in frames:
+        colors = np.union1d(colors, frame)
+        samples.append(frame.reshape(-1)[::stride].copy())  # the frame itself is not kept
+        nb_sampled += len(samples[-1])
+        if nb_sampled > 2 * QUANTIZE_SAMPLE:
+            samples = [np.concatenate(samples)[::2]]
+            nb_sampled, stride = len(samples[0]), stride * 2
+    if len(colors) <= GIF_TRANSPARENT:  # the smallest palette holding the colors and the transparent one
+        palette = np.zeros((max(2, 1 << len(colors).bit_length()), 3), dtype=np.uint8)
+        palette[:len(colors)] = _unpacked_rgb(colors)
+        return colors, np.arange(len(colors)), palette
+    palette = np.zeros((256, 3), dtype=np.uint8)
+    pixels = np.concatenate(samples)
+    pixels = pixels[::max(1, len(pixels) // QUANTIZE_SAMPLE)]
+    reference = Image.fromarray(_unpacked_rgb(pixels)[np.newaxis]).quantize(
+        GIF_TRANSPARENT, method=Image.Quantize.MEDIANCUT)
+    quantized = Image.fromarray(_unpacked_rgb(colors)[np.newaxis]).quantize(
+        palette=reference, dither=Image.Dither.NONE)
+    used = np.array(reference.getpalette()[:3*GIF_TRANSPARENT], dtype=np.uint8).reshape(-1, 3)
+    palette[:len(used)] = used
+    return colors, np.asarray(quantized).reshape(-1), palette
+
+
+def _packed_rgb(frame) -> np.ndarray:
+    """Return given frame (filename or array) as an (H, W) array of 0xRRGGBB colors"""
+    if isinstance(frame, str):
+        frame = imageio.imread(frame)
+    frame = np.asarray(frame, dtype=np.uint32)
+    return frame[..., 0] << 16 | frame[..., 1] << 8 | frame[..., 2]
+
+def _unpacked_rgb(colors:np.ndarray) -> np.ndarray:
+    return np.stack((colors >> 16, colors >> 8, colors), axis=-1).astype(np.uint8)
+
+def _write_gif_frame(fd, image:Image.Image, offset:(int, int), duration:float,
+                     transparent:int=GIF_TRANSPARENT):
+    """Write given indexed image at given offset, drawn over the previous frame"""
+    for data in GifImagePlugin.getdata(image, offset, duration=duration,
+                                       disposal=1, transparency=transparent):
+        fd.write(data)
 
 
 def draw_circle(nb_point:int=1000):
@@ -194,5 +648,6 @@ if __name__ == "__main__":
 
     # data = graph_module.cube()
     data = graph_module.double_tetrahedron()
-    # write_gif(run_things(data, nb_point=100, verbose=False), duration=0.01)
+    # write_gif(run_things(data, nb_point=100), duration=0.01)
+    logging.basicConfig(level=logging.DEBUG)
     write_gif(run_things(data, nb_point=1, fname_template='graph.png', verbose=True))
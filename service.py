@@ -0,0 +1,323 @@
+"""Long running render service, keeping imported modules, loaded graphs
+and their spatial indexes warm between jobs.
+
+Jobs are posted as JSON to a local HTTP server, queued, and rendered
+by a fixed number of worker threads:
+
+    python service.py --port 8765 --workers 2
+    curl -X POST localhost:8765/jobs -d '{"graph": {"generator": "cloud", "nb_node": 1000}, "gif": "graph.gif"}'
+    curl 'localhost:8765/jobs/1?wait=1'
+
+Fields of a job:
+
+- graph: {"file": path, "links": path} read by loaders.load,
+  or {"generator": name, ...arguments} built by one of graph.GENERATORS.
+- nb_point, distance_to_object_factor: orbit of the camera, see render_gif.run_things.
+- camera: {"path": name, ...arguments} camera path of CAMERA_PATHS replacing the orbit,
+  with optional "target" coords (default to the graph center), "nb_frame" (default 100)
+  and "threshold": if given, frames are sampled adaptively (see camera.sample_povs).
+- frames: template of frame filenames, or null (default) to keep frames in memory.
+- gif: filename of the gif to write, if any, with "duration" and "delta" given to write_gif.
+- index: if true, frames are culled with a spatial index of the graph.
+- draw_options: options given to draw_2d_graph, except graph, fname and center.
+
+"""
+
+import json
+import inspect
+import time
+import queue
+import logging
+import argparse
+import itertools
+import threading
+import collections
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import loaders
+import render_gif
+import spatial
+import camera
+import cache as cache_module
+from graph import GENERATORS
+from projection import POV
+
+
+LOGGER = logging.getLogger(__name__)
+DEFAULT_PORT = 8765
+MAX_GRAPHS = 8  # number of loaded graphs kept in memory
+MAX_JOBS = 1000  # number of finished jobs kept for status requests
+JOB_OPTIONS = {'graph', 'nb_point', 'distance_to_object_factor', 'camera', 'frames',
+               'gif', 'duration', 'delta', 'index', 'draw_options'}
+CAMERA_PATHS = {'circle': camera.Circle, 'helix': camera.Helix, 'spline': camera.Spline}
+CAMERA_OPTIONS = {'path', 'target', 'nb_frame', 'threshold'}  # beside the arguments of the path
+DRAW_OPTIONS = set(inspect.signature(render_gif.draw_2d_graph).parameters) - {'graph', 'fname', 'center'}
+
+
+class Job:
+    """A render job, with its status: queued, running, done or failed"""
+
+    def __init__(self, id:int, spec:dict):
+        self.id, self.spec = id, spec
+        self.status, self.result, self.error = 'queued', None, None
+        self.submitted, self.started, self.finished = time.time(), None, None
+        self.done = threading.Event()
+
+    def as_dict(self) -> dict:
+        return {
+            'id': self.id, 'status': self.status, 'result': self.result, 'error': self.error,
+            'submitted': self.submitted, 'started': self.started, 'finished': self.finished,
+        }
+
+
+class RenderService:
+    """Queue of render jobs, rendered by worker threads sharing loaded graphs.
+
+    At most queue_size jobs wait for a worker: submitting more raises queue.Full.
+
+    """
+
+    def __init__(self, workers:int=2, queue_size:int=64, cache_dir:str=None,
+                 max_graphs:int=MAX_GRAPHS):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.jobs = collections.OrderedDict()
+        self.graphs = collections.OrderedDict()  # source key -> (graph, spatial index or None)
+        self.max_graphs = max_graphs
+        self.cache = None if cache_dir is None else cache_module.ProjectionCache(cache_dir)
+        self.graphs_loaded = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+
+    def start(self) -> 'RenderService':
+        for worker in self._workers:
+            worker.start()
+        return self
+
+    def stop(self):
+        """Wait for queued jobs, then stop the workers"""
+        for _ in self._workers:
+            self.queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def submit(self, spec:dict) -> Job:
+        """Queue a job of given spec, and return it"""
+        if not isinstance(spec, dict):
+            raise ValueError("A job is given as a JSON object")
+        unknown = set(spec) - JOB_OPTIONS
+        if unknown:
+            raise ValueError("Unknown job options: {}".format(', '.join(sorted(unknown))))
+        _source_key(spec.get('graph'))
+        if 'camera' in spec:
+            _camera_path(spec['camera'])
+        draw_options = spec.get('draw_options', {})
+        if not isinstance(draw_options, dict):
+            raise ValueError("Job draw_options are given as a JSON object")
+        unknown = set(draw_options) - DRAW_OPTIONS
+        if unknown:
+            raise ValueError("Unknown draw options: {}".format(', '.join(sorted(unknown))))
+        with self._lock:
+            job = Job(next(self._ids), spec)
+            self.queue.put_nowait(job)
+            self.jobs[job.id] = job
+            # oldest finished jobs are forgotten first, unfinished ones are bounded by the queue
+            finished = [id for id, job_ in self.jobs.items() if job_.done.is_set()]
+            for id in finished[:max(0, len(self.jobs) - MAX_JOBS)]:
+                del self.jobs[id]
+        return job
+
+    def job(self, id:int) -> Job or None:
+        return self.jobs.get(id)
+
+    def graph(self, source:dict, index:bool=False) -> (object, spatial.Octree or None):
+        """Return the graph of given source, and its spatial index if asked,
+        loading them only if they are not already in memory"""
+        key = _source_key(source)
+        with self._lock:
+            cached = self.graphs.get(key)
+            if cached is not None:
+                self.graphs.move_to_end(key)
+        if cached is None:
+            LOGGER.info('Loading graph %s', key)
+            graph, octree = _load_graph(source), None
+            self.graphs_loaded += 1
+        else:
+            graph, octree = cached
+        if index and octree is None:
+            octree = spatial.Octree.from_graph(graph)
+        if cached is None or cached[1] is not octree:
+            with self._lock:
+                self.graphs[key] = graph, octree
+                while len(self.graphs) > self.max_graphs:
+                    self.graphs.popitem(last=False)
+        return graph, octree if index else None
+
+    def render(self, spec:dict) -> dict:
+        """Render the job of given spec, and return a description of its outputs"""
+        graph, octree = self.graph(spec['graph'], index=spec.get('index', False))
+        povs, duration = None, spec.get('duration', 1)
+        if 'camera' in spec:
+            povs, duration = _camera_povs(spec['camera'], graph, duration, spec.get('draw_options', {}))
+        frames = render_gif.run_things(
+            graph, nb_point=spec.get('nb_point', 100),
+            distance_to_object_factor=spec.get('distance_to_object_factor', 4.7),
+            fname_template=spec.get('frames'), index=octree, cache=self.cache, povs=povs,
+            **spec.get('draw_options', {}))
+        frames = list(frames)
+        if spec.get('gif'):
+            render_gif.write_gif(frames, duration=duration, fname=spec['gif'],
+                                 delta=spec.get('delta', False))
+        return {'gif': spec.get('gif'), 'frames': frames if spec.get('frames') else None,
+                'nb_frame': len(frames)}
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            job.status, job.started = 'running', time.time()
+            try:
+                job.result = self.render(job.spec)
+                job.status = 'done'
+            except Exception as error:
+                LOGGER.exception('Job %s failed', job.id)
+                job.status, job.error = 'failed', '{}: {}'.format(type(error).__name__, error)
+            job.finished = time.time()
+            job.done.set()
+
+    def stats(self) -> dict:
+        statuses = collections.Counter(job.status for job in list(self.jobs.values()))
+        return {
+            'queued': self.queue.qsize(), 'jobs': dict(statuses),
+            'graphs': len(self.graphs), 'graphs_loaded': self.graphs_loaded,
+            'cache': None if self.cache is None else self.cache.stats(),
+        }
+
+
+def _source_key(source:dict) -> str:
+    """Return a key identifying given graph source, or raise ValueError if it is invalid"""
+    if not isinstance(source, dict) or not ({'file', 'generator'} & set(source)):
+        raise ValueError("Job graph must be given by a file or a generator")
+    if 'generator' in source:
+        if source['generator'] not in GENERATORS:
+            raise ValueError("Unknown graph generator: {}".format(source['generator']))
+        _check_arguments(GENERATORS[source['generator']], _arguments(source, {'generator'}),
+                         'generator ' + source['generator'])
+    return json.dumps(source, sort_keys=True)
+
+def _arguments(options:dict, excluded:set) -> dict:
+    return {name: value for name, value in options.items() if name not in excluded}
+
+def _check_arguments(func:callable, arguments:dict, name:str):
+    """Raise ValueError if given arguments can't be given to func"""
+    try:
+        inspect.signature(func).bind(**arguments)
+    except TypeError as error:
+        raise ValueError("Invalid arguments of {}: {}".format(name, error))
+
+def _camera_path(options:dict):
+    """Return the camera path described by given job camera options,
+    or raise ValueError if they are invalid"""
+    if not isinstance(options, dict) or options.get('path') not in CAMERA_PATHS:
+        raise ValueError("Job camera must be given by a path among: {}".format(', '.join(CAMERA_PATHS)))
+    path_type, arguments = CAMERA_PATHS[options['path']], _arguments(options, CAMERA_OPTIONS)
+    _check_arguments(path_type, arguments, 'camera path ' + options['path'])
+    return path_type(**arguments)
+
+def _camera_povs(options:dict, graph, duration:float, draw_options:dict) -> ([POV], float or [float]):
+    """Return the POVs of given job camera options, and the duration of each frame"""
+    path = _camera_path(options)
+    target = options.get('target') or graph.center
+    nb_frame = options.get('nb_frame', 100)
+    if options.get('threshold') is None:
+        return camera.povs_along(path, target, camera.parameters(path, nb_frame)), duration
+    size = draw_options.get('width', 400), draw_options.get('height', 400)
+    return camera.sample_povs(path, target, render_gif.graph_arrays(graph)[0], nb_frame=nb_frame,
+                              threshold=options['threshold'], size=size, duration=duration)
+
+def _load_graph(source:dict):
+    if 'file' in source:
+        return loaders.load(source['file'], source.get('links'))
+    return GENERATORS[source['generator']](**_arguments(source, {'generator'}))
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """HTTP interface of the RenderService given to make_server:
+
+    - POST /jobs: queue the job given as JSON body, answer its id
+    - GET /jobs/<id>: status of the job, waiting for its end if ?wait=1
+    - GET /stats: counts of jobs, loaded graphs and cache usage
+
+    """
+    service = None  # set by make_server
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/jobs':
+            return self._answer(404, {'error': 'Not found'})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            job = self.service.submit(json.loads(self.rfile.read(length) or b'{}'))
+        except (ValueError, TypeError) as error:
+            return self._answer(400, {'error': str(error)})
+        except queue.Full:
+            return self._answer(503, {'error': 'Job queue is full'})
+        self._answer(202, job.as_dict())
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            return self._answer(200, self.service.stats())
+        parts = url.path.strip('/').split('/')
+        job = None
+        if len(parts) == 2 and parts[0] == 'jobs' and parts[1].isdigit():
+            job = self.service.job(int(parts[1]))
+        if job is None:
+            return self._answer(404, {'error': 'Not found'})
+        if parse_qs(url.query).get('wait') == ['1']:
+            job.done.wait()
+        self._answer(200, job.as_dict())
+
+    def _answer(self, code:int, content:dict):
+        body = json.dumps(content).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format:str, *args):
+        LOGGER.debug(format, *args)
+
+
+def make_server(service:RenderService, host:str='127.0.0.1', port:int=DEFAULT_PORT) -> ThreadingHTTPServer:
+    """Return an HTTP server giving access to given service"""
+    handler = type('BoundRequestHandler', (RequestHandler,), {'service': service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def cli() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port to listen on')
+    parser.add_argument('--workers', type=int, default=2, help='number of jobs rendered at once')
+    parser.add_argument('--queue-size', type=int, default=64, help='maximal number of waiting jobs')
+    parser.add_argument('--cache-dir', default=None, help='directory of the projection cache, if any')
+    return parser
+
+
+if __name__ == "__main__":
+    args = cli().parse_args()
+    logging.basicConfig(level=logging.INFO)
+    service = RenderService(workers=args.workers, queue_size=args.queue_size,
+                            cache_dir=args.cache_dir).start()
+    server = make_server(service, args.host, args.port)
+    LOGGER.info('Serving on %s:%s', *server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
@@ -0,0 +1,173 @@
+"""Spatial index over the nodes of a graph, used to cull nodes
+out of the field of view of a POV before projecting them.
+
+The Octree is built once for a graph, and reused for each frame.
+Its cells are tested against the POV field of view by their bounding sphere:
+cells out of the field of view are rejected with all their nodes,
+cells fully inside are accepted with all their nodes,
+and only leaves crossing the field of view boundaries give nodes
+that may be out of view, discarded later by the projection.
+
+"""
+
+import numpy as np
+
+import geometry
+import graph as graph_module
+from projection import POV
+
+
+LEAF_SIZE = 256  # maximal number of nodes in a leaf cell
+MAX_DEPTH = 21  # cells are not split beyond this depth, whatever their size
+OUT, CROSSING, IN = 0, 1, 2  # position of a cell relative to the field of view
+
+
+class Octree:
+    """Octree over given (N, 3) nodes coords, optionally indexing
+    the (E, 2) links between them by source node.
+
+    Nodes of each cell are a contiguous range of self.order.
+    Cells are stored by level: children of a cell are contiguous,
+    and the root is the cell 0.
+
+    """
+
+    def __init__(self, nodes:np.ndarray, links:np.ndarray=None, leaf_size:int=LEAF_SIZE):
+        self.nodes = np.asanyarray(nodes)
+        self.order = np.arange(len(self.nodes), dtype=np.intp)
+        starts, ends, centers, radii, nb_childs = [], [], [], [], []
+        level = [(0, len(self.nodes), 0)]  # (start, end, depth) of cells to create
+        while level:
+            next_level = []
+            for start, end, depth in level:
+                coords = np.asarray(self.nodes[self.order[start:end]], dtype=float).reshape(-1, 3)
+                low, high = (coords.min(axis=0), coords.max(axis=0)) if end > start else (np.zeros(3),) * 2
+                starts.append(start)
+                ends.append(end)
+                centers.append((low + high) / 2)
+                radii.append(np.linalg.norm(high - low) / 2)
+                if end - start <= leaf_size or depth >= MAX_DEPTH or (high == low).all():
+                    nb_childs.append(0)
+                    continue
+                children = self._split(start, end, coords, (low + high) / 2)
+                nb_childs.append(len(children))
+                next_level.extend((child_start, child_end, depth + 1)
+                                  for child_start, child_end in children)
+            level = next_level
+        self.starts = np.array(starts, dtype=np.intp)
+        self.ends = np.array(ends, dtype=np.intp)
+        self.centers = np.array(centers, dtype=float).reshape(-1, 3)
+        self.radii = np.array(radii, dtype=float)
+        self.nb_childs = np.array(nb_childs, dtype=np.intp)
+        # in level order, children of cell i follow the children of all cells before i
+        self.first_childs = np.cumsum(self.nb_childs) - self.nb_childs + 1
+        self._index_links(links)
+
+    @staticmethod
+    def from_graph(graph, leaf_size:int=LEAF_SIZE) -> 'Octree':
+        graph = graph_module.as_array_graph(graph)
+        return Octree(graph.nodes, graph.links, leaf_size=leaf_size)
+
+    def _split(self, start:int, end:int, coords:np.ndarray, middle:np.ndarray) -> [(int, int)]:
+        """Reorder nodes of given range by octant around middle,
+        and return the (start, end) ranges of non-empty octants"""
+        octants = (coords > middle) @ np.array((1, 2, 4))
+        ordering = np.argsort(octants, kind='stable')
+        self.order[start:end] = self.order[start:end][ordering]
+        bounds = np.searchsorted(octants[ordering], np.arange(9)) + start
+        return [(low, high) for low, high in zip(bounds[:-1], bounds[1:]) if high > low]
+
+    def _index_links(self, links:np.ndarray or None):
+        """Sort links by source node, so that links of a node are a contiguous range"""
+        if links is None:
+            self.links = self.link_offsets = None
+            return
+        links = np.asarray(links).reshape(-1, 2)
+        self.links = links[np.argsort(links[:, 0], kind='stable')]
+        self.link_offsets = np.searchsorted(self.links[:, 0], np.arange(len(self.nodes) + 1))
+
+    def classify(self, cells:np.ndarray, pov:POV) -> np.ndarray:
+        """Return OUT, CROSSING or IN for each given cell,
+        according to the position of its bounding sphere relative to POV field of view"""
+        coords = geometry.Transform.system(pov.coords, pov.rotation).apply_many(self.centers[cells])
+        radii = self.radii[cells]
+        if pov.model == 'pinhole':
+            return _classify_in_frustum(coords, radii, pov)
+        dist = np.sqrt(np.sum(coords**2, axis=1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # angular radius of the sphere, seen from the POV
+            spread = np.degrees(np.arcsin(np.clip(radii / dist, 0, 1)))
+            # angle with the view axis, and elevation over the horizontal plane
+            angle = np.degrees(np.arccos(np.clip(coords[:, 0] / dist, -1, 1)))
+            elevation = np.abs(np.degrees(np.arcsin(np.clip(coords[:, 1] / dist, -1, 1))))
+        out = (angle - spread > pov.width / 2) | (elevation - spread > pov.height / 2)
+        inside = (angle + spread <= pov.width / 2) & (elevation + spread <= pov.height / 2)
+        classes = np.where(out, OUT, np.where(inside, IN, CROSSING))
+        classes[dist <= radii] = CROSSING  # POV inside the sphere
+        return classes
+
+    def candidates(self, pov:POV) -> np.ndarray:
+        """Return the sorted indexes of nodes that may be in the POV field of view.
+        Nodes out of the returned ones are guaranteed out of view."""
+        ranges = []
+        cells = np.zeros(1, dtype=np.intp)
+        while len(cells):
+            classes = self.classify(cells, pov)
+            leaves = self.nb_childs[cells] == 0
+            kept = cells[(classes == IN) | ((classes == CROSSING) & leaves)]
+            ranges.append((self.starts[kept], self.ends[kept]))
+            split = cells[(classes == CROSSING) & ~leaves]
+            cells = expand_ranges(self.first_childs[split], self.first_childs[split] + self.nb_childs[split])
+        starts = np.concatenate([starts for starts, _ in ranges])
+        ends = np.concatenate([ends for _, ends in ranges])
+        return np.sort(self.order[expand_ranges(starts, ends)])
+
+    def cull(self, pov:POV) -> (np.ndarray, np.ndarray):
+        """Return the sorted indexes of candidate nodes (see candidates),
+        and the (K, 2) links between them, as indexes in the candidates array.
+        Links with a culled node are dropped."""
+        candidates = self.candidates(pov)
+        return candidates, self._links_between(candidates)
+
+    def cull_many(self, povs:[POV]) -> (np.ndarray, np.ndarray):
+        """Return the sorted indexes of nodes that are candidates for at least
+        one of given POVs, and the links between them, as cull"""
+        candidates = np.unique(np.concatenate([self.candidates(pov) for pov in povs]))
+        return candidates, self._links_between(candidates)
+
+    def _links_between(self, candidates:np.ndarray) -> np.ndarray:
+        """Return the (K, 2) links between given sorted nodes,
+        as indexes in the candidates array"""
+        if self.links is None:
+            return np.empty((0, 2), dtype=np.intp)
+        links = self.links[expand_ranges(self.link_offsets[candidates],
+                                          self.link_offsets[candidates + 1])]
+        targets = np.searchsorted(candidates, links[:, 1])
+        kept = targets < len(candidates)
+        kept[kept] = candidates[targets[kept]] == links[kept, 1]
+        sources = np.searchsorted(candidates, links[kept, 0])
+        return np.stack((sources, targets[kept]), axis=-1)
+
+
+def _classify_in_frustum(coords:np.ndarray, radii:np.ndarray, pov:POV) -> np.ndarray:
+    """Return OUT, CROSSING or IN for spheres of given centers, in the POV system,
+    and radii, according to their position relative to the pinhole POV frustum"""
+    half_width, half_height = np.radians(pov.width) / 2, np.radians(pov.height) / 2
+    # unit normals of the side planes, going through the POV, pointing outside
+    normals = np.array((
+        (-np.sin(half_width), 0, np.cos(half_width)), (-np.sin(half_width), 0, -np.cos(half_width)),
+        (-np.sin(half_height), np.cos(half_height), 0), (-np.sin(half_height), -np.cos(half_height), 0),
+    ))
+    distances = np.column_stack((coords @ normals.T, pov.near - coords[:, 0], coords[:, 0] - pov.far))
+    out = (distances > radii[:, np.newaxis]).any(axis=1)
+    inside = (distances < -radii[:, np.newaxis]).all(axis=1)
+    return np.where(out, OUT, np.where(inside, IN, CROSSING))
+
+
+def expand_ranges(starts:np.ndarray, ends:np.ndarray) -> np.ndarray:
+    """Return the concatenation of ranges [start, end) for given starts and ends"""
+    lengths = ends - starts
+    if not lengths.sum():
+        return np.empty(0, dtype=np.intp)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return np.arange(lengths.sum(), dtype=np.intp) + offsets
@@ -1,9 +1,28 @@
+import json
+import itertools
+import threading
+import tracemalloc
+import urllib.error
+import urllib.request
 import math
+import pytest
+import imageio.v2 as imageio
+import numpy as np
+from PIL import Image, ImageSequence
 import projection
 from projection import Coords
 import graph
 import render_gif
 import geometry
+import diagnostics
+import bench
+import loaders
+import spatial
+import camera
+import animation
+import raster
+import cache as cache_module
+import service as render_service
 from geometry import Coords
 
 
@@ -78,3 +97,542 @@ def test_coords_in_system():
     for x in range(-90, 90, 20):
         assert rounded(coords_in_system(Coords(1, 1, 10), a, Coords(0, 0, x))) == rounded(Coords(0, 0, 10))
     assert rounded(coords_in_system(a, null, Coords(0, -90, 0))) == rounded(Coords(0, 1, -1))
+
+
+def test_project_many():
+    pov = projection.POV(Coords(0, 0, 0), Coords(0, 0, 30), 90, 90)
+    points = [(x, y, z) for x in range(-3, 4, 2) for y in range(-3, 4, 2) for z in (-2, 1, 5)]
+    projections, visible = projection.project_many(points, pov)
+    assert projections.shape == (len(points), 3) and visible.shape == (len(points),)
+    assert visible.any() and not visible.all()
+    for point, proj, is_visible in zip(points, projections, visible):
+        expected = projection.projection(Coords(*point), pov, verbose=False)
+        assert (expected is not None) == is_visible
+        if expected is not None:
+            assert all(math.isclose(a, b, abs_tol=1e-9) for a, b in zip(expected, proj))
+
+
+def test_pinhole_projection():
+    pov = projection.POV(Coords(1, 2, 3), Coords(10, 20, 30), 60, 40)
+    pinhole = pov._replace(model='pinhole')
+    to_world = geometry.Transform.system(pov.coords, pov.rotation).inverse()
+    # points on the view axis, and on the field edges in the (x, y) and (x, z) planes
+    depths = np.array((1., 5., 30.))
+    on_axis = np.stack((depths, 0 * depths, 0 * depths), axis=-1)
+    edges = np.array(((10, math.tan(math.radians(19.9)) * 10, 0), (10, -math.tan(math.radians(19.9)) * 10, 0),
+                      (10, 0, math.tan(math.radians(29.9)) * 10)))
+    for points in (on_axis, edges):
+        angle, angle_visible = projection.project_many(to_world.apply_many(points), pov)
+        perspective, perspective_visible = projection.project_many(to_world.apply_many(points), pinhole)
+        assert angle_visible.all() and perspective_visible.all()
+        assert np.allclose(angle[:, 1], perspective[:, 1], atol=1e-3)
+    assert np.allclose(perspective[2, :2], angle[2, :2], atol=1e-3)  # horizontal edge
+    assert np.allclose(projection.project_many(to_world.apply_many(on_axis), pinhole)[0],
+                       projection.project_many(to_world.apply_many(on_axis), pov)[0])
+    # near and far clipping
+    clipped = pinhole._replace(near=2, far=20)
+    assert projection.project_many(to_world.apply_many(on_axis), clipped)[1].tolist() == [False, True, False]
+    assert projection.projection(Coords(*to_world.apply(on_axis[0])), clipped) is None
+    assert np.allclose(projection.projection(Coords(*to_world.apply(on_axis[1])), clipped), (0.5, 0.5, 2))
+    # field of view given by vertical angle and aspect ratio
+    wide = projection.pinhole_pov(Coords(0, 0, 0), Coords(0, 0, 0), fov=40, aspect=2)
+    assert wide.height == 40 and math.isclose(math.tan(math.radians(wide.width / 2)), 2 * math.tan(math.radians(20)))
+    # batched and culled pinhole projection give the same result
+    data = graph.as_array_graph(graph.random_cloud(2000, seed=1))
+    povs = [projection.pov_looking_at(data.center, (x, 60, 40), 50, 40)._replace(model='pinhole', near=20, far=150)
+            for x in (60, 200, 300)]
+    projections, visible = projection.project_orbit(data.nodes, povs)
+    index = spatial.Octree.from_graph(data, leaf_size=32)
+    for frame, pov in enumerate(povs):
+        expected, expected_visible = projection.project_many(data.nodes, pov)
+        assert np.allclose(projections[frame], expected) and (visible[frame] == expected_visible).all()
+        assert set(np.nonzero(expected_visible)[0]) <= set(index.candidates(pov).tolist())
+    mixed_projections, mixed_visible = projection.project_orbit(data.nodes, [povs[0], povs[1]._replace(model='angle')])
+    assert (mixed_visible[0] == visible[0]).all() and mixed_projections.shape == (2, 2000, 3)
+    assert render_gif.draw_3d_graph(data, (200, 60, 40), fname=None, pov=povs[1])[..., :3].any()
+
+
+def test_transform():
+    Transform = geometry.Transform
+    ROUNDING = 4
+    rounded = lambda c: tuple(round(v, ROUNDING) for v in c)
+    rotation, origin = Coords(10, -30, 45), Coords(1, 2, 3)
+    assert Transform.rotation(rotation) is Transform.rotation(list(rotation))  # cached
+    system = Transform.system(origin, rotation)
+    point = Coords(4, -2, 7)
+    assert rounded(system.apply(point)) == rounded(geometry.coords_in_system(point, origin, rotation))
+    assert rounded(system.inverse().apply(system.apply(point))) == rounded(point)
+    assert rounded((system.inverse() @ system).apply(point)) == rounded(point)
+    assert Transform.identity().apply(point) == point
+    many = system.apply_many([point, origin])
+    assert rounded(many[0]) == rounded(system.apply(point))
+    assert rounded(many[1]) == (0, 0, 0)
+
+
+def test_project_orbit():
+    center = Coords(3, 4, 5)
+    povs = [projection.create_pov_toward(center, Coords(x, 4, z))
+            for x, z in render_gif.points_on_circle((3, 5), 10, nb_point=7)]
+    nodes, edges = render_gif.graph_arrays(graph.cube())
+    projections, visible = projection.project_orbit(nodes, povs)
+    assert projections.shape == (7, len(nodes), 3) and visible.shape == (7, len(nodes))
+    for pov, frame, frame_visible in zip(povs, projections, visible):
+        expected, expected_visible = projection.project_many(nodes, pov)
+        assert (frame_visible == expected_visible).all()
+        assert np.allclose(frame[frame_visible], expected[expected_visible])
+    assert visible.any()
+    # default batches of orbit frames fit in the memory budget
+    assert render_gif.orbit_batch_size(10**6) == 1
+    assert render_gif.orbit_batch_size(1000) * 1000 * 24 * render_gif.ORBIT_TEMPORARIES <= render_gif.ORBIT_BATCH_BYTES
+
+
+def test_parallel_rendering(tmp_path):
+    template = str(tmp_path / 'graph_{num:03d}.png')
+    data = graph.double_tetrahedron()
+    sequential = list(render_gif.run_things(data, nb_point=6, fname_template=template, verbose=False))
+    images = [imageio.imread(fname) for fname in sequential]
+    parallel = list(render_gif.run_things(data, nb_point=6, fname_template=template, verbose=False, workers=2))
+    assert parallel == sequential
+    assert all((imageio.imread(fname) == image).all() for fname, image in zip(parallel, images))
+
+
+def test_in_memory_frames(tmp_path):
+    data = graph.cube()
+    template = str(tmp_path / 'graph_{num:03d}.png')
+    fnames = list(render_gif.run_things(data, nb_point=4, fname_template=template, verbose=False))
+    frames = list(render_gif.run_things(data, nb_point=4, fname_template=None, verbose=False))
+    assert len(frames) == 4 and frames[0].shape == (400, 400, 4)
+    assert all((imageio.imread(fname) == frame).all() for fname, frame in zip(fnames, frames))
+    render_gif.write_gif(frames, duration=0.1, fname=str(tmp_path / 'graph.gif'))
+    assert len(imageio.mimread(str(tmp_path / 'graph.gif'))) == 4
+
+
+def test_delta_gif(tmp_path, monkeypatch):
+    frames = list(render_gif.run_things(graph.double_tetrahedron(), nb_point=6, fname_template=None))
+    frames.append(frames[-1])  # merged with the previous one
+    fname = str(tmp_path / 'delta.gif')
+    render_gif.write_gif(frames, duration=20, fname=fname, delta=True)
+    with Image.open(fname) as image:
+        decoded = [(np.array(frame.convert('RGB')), frame.info['duration']) for frame in ImageSequence.Iterator(image)]
+    distinct = [frame for previous, frame in zip([None] + frames, frames)
+                if previous is None or (previous != frame).any()]
+    assert len(decoded) == len(distinct) and decoded[-1][1] >= 40
+    assert all((pixels == frame[..., :3]).all() for (pixels, _), frame in zip(decoded, distinct))
+    # frames may be given by a generator, and few colors give a small palette
+    with open(fname, 'rb') as fd:
+        written = fd.read()
+    render_gif.write_gif(iter(frames), duration=20, fname=fname, delta=True)
+    with open(fname, 'rb') as fd:
+        assert fd.read() == written and written[10] & 0x07 < 7
+    # more colors than a gif palette can hold
+    rng = np.random.default_rng(0)
+    noise = rng.integers(0, 256, (30, 40, 4), dtype=np.uint8)
+    moved = noise.copy()
+    moved[5:10, 5:10] = 0
+    render_gif.write_gif([noise, moved], fname=fname, delta=True)
+    with Image.open(fname) as image:
+        decoded = [np.array(frame.convert('RGB')) for frame in ImageSequence.Iterator(image)]
+    assert len(decoded) == 2 and (decoded[1][5:10, 5:10] == 0).all()
+    assert (decoded[1][10:] == decoded[0][10:]).all()
+    # the pixels sampled for quantization stay bounded whatever the number of frames
+    monkeypatch.setattr(render_gif, 'QUANTIZE_SAMPLE', 1000)
+    packed = (rng.integers(0, 300, (200, 200)).astype(np.uint32) for _ in range(40))
+    tracemalloc.start()
+    try:
+        colors, indexes, palette = render_gif.global_palette(packed)
+        assert tracemalloc.get_traced_memory()[1] < 40 * 200 * 200 * 4 / 2
+    finally:
+        tracemalloc.stop()
+    assert len(colors) == len(indexes) == 300 and palette.shape == (256, 3)
+
+
+def test_camera_paths(tmp_path):
+    data = graph.as_array_graph(graph.random_cloud(300, seed=4))
+    center = np.array(data.center)
+    keyframes = center + np.array(((400, 0, 0), (0, 100, 400), (-400, 0, 0), (0, -100, -400)))
+    paths = (camera.Circle(data.center, 400), camera.Helix(data.center, 400, 200, 2),
+             camera.Spline(keyframes), camera.Spline(keyframes, closed=True))
+    for path in paths:
+        ts = camera.parameters(path, 9)
+        positions = path.positions(ts)
+        assert positions.shape == (9, 3)
+        for pov in camera.povs_along(path, data.center, ts):
+            projected, visible = projection.project_many(center[np.newaxis], pov)
+            assert visible[0] and np.allclose(projected[0, :2], 0.5)
+    spline = camera.Spline(keyframes)
+    assert np.allclose(spline.positions(np.linspace(0, 1, 4)), keyframes)
+    assert np.allclose(camera.Spline(keyframes, closed=True).positions(np.array((0., 1.))), keyframes[0])
+    # a fixed camera gives a single long frame, a moving one many frames
+    fixed = camera.Spline(((400, 0, 0), (400, 0, 0)))
+    povs, durations = camera.sample_povs(fixed, data.center, data.nodes, nb_frame=10, duration=5)
+    assert len(povs) == 1 and durations == [50]
+    povs, durations = camera.sample_povs(paths[0], data.center, data.nodes, nb_frame=10, duration=5)
+    assert len(povs) == 10 and sum(durations) == 50
+    slow = camera.Helix(data.center, 400, 1, 0.05)
+    povs, durations = camera.sample_povs(slow, data.center, data.nodes, nb_frame=50, threshold=2)
+    assert 1 < len(povs) < 50 and sum(durations) == 50
+    frames = list(render_gif.run_things(data, fname_template=None, povs=povs))
+    assert len(frames) == len(povs)
+    assert all((frame == image).all() for frame, image in zip(
+        frames, render_gif.run_things(data, fname_template=None, povs=povs, orbit=False)))
+    fname = str(tmp_path / 'path.gif')
+    for delta in (False, True):
+        render_gif.write_gif(frames, duration=[10 * d for d in durations], fname=fname, delta=delta)
+        with Image.open(fname) as image:
+            assert sum(frame.info['duration'] for frame in ImageSequence.Iterator(image)) == 500
+
+
+def test_multi_view_rendering(tmp_path):
+    data = graph.as_array_graph(graph.random_cloud(2000, seed=5))
+    povs = camera.contact_sheet_povs(data.center, 300) + camera.stereo_povs(data.center, (300, 50, 50), 10)
+    assert len(povs) == 6
+    for pov in povs[:4]:
+        assert np.allclose(projection.project_many(np.array((data.center,)), pov)[0][0, :2], 0.5)
+    left, right = povs[4:]
+    assert math.isclose(geometry.distance_between(left.coords, right.coords), 10) and left.rotation == right.rotation
+    expected = [render_gif.draw_3d_graph(data, pov.coords, fname=None, pov=pov) for pov in povs]
+    views = render_gif.draw_views(data, povs)
+    assert all((view == image).all() for view, image in zip(views, expected))
+    index = spatial.Octree.from_graph(data, leaf_size=64)
+    assert all((view == image).all() for view, image in zip(render_gif.draw_views(data, povs, index=index), expected))
+    fnames = render_gif.draw_views(data, povs[:2], fname_template=str(tmp_path / 'view_{num}.png'))
+    assert fnames == [str(tmp_path / 'view_1.png'), str(tmp_path / 'view_2.png')]
+    tiled = render_gif.tile_frames(views)
+    assert tiled.shape == (800, 1200, 4)
+    assert (tiled[400:, 400:800] == views[4]).all() and (tiled[:400, 800:] == views[2]).all()
+    assert render_gif.tile_frames(fnames, columns=1).shape == (800, 400, 4)
+
+
+def test_animation(tmp_path, monkeypatch):
+    data = graph.as_array_graph(graph.random_cloud(3000, seed=3))
+    pov = projection.create_pov_toward(data.center, Coords(400, 50, 50))
+    rng = np.random.default_rng(0)
+    with open(tmp_path / 'moves.txt', 'w') as fd:
+        fd.write('# frame node x y z\n')
+        for frame in (0, 1, 3, 4):  # no move at frame 2
+            for node in rng.choice(len(data.nodes), 20, replace=False):
+                fd.write('{} {} {} {} {}\n'.format(frame, node, *(data.nodes[node] + rng.normal(0, 30, 3))))
+    updates = list(animation.load_updates(str(tmp_path / 'moves.txt'), chunk_size=7))
+    assert [len(indexes) for indexes, _ in updates] == [20, 20, 0, 20, 20]
+    # dirty tiles are drawn alone, or the whole frame when they hold most of the graph
+    for ratio, options in itertools.product((animation.FULL_REDRAW_RATIO, float('inf')),
+                                            ({}, {'depth_test': True}, {'antialias': True})):
+        monkeypatch.setattr(animation, 'FULL_REDRAW_RATIO', ratio)
+        player = animation.Animation(data, pov, **options)
+        nodes = np.array(data.nodes, dtype=float)
+        for indexes, coords in updates:
+            frame = player.update(indexes, coords)
+            nodes[indexes] = coords
+            projections, visible = projection.project_many(nodes, pov)
+            assert (player.visible == visible).all() and np.allclose(player.projections[visible], projections[visible])
+            expected = render_gif.draw_projected_graph(player.projections, player.visible, data.links, fname=None,
+                                                       center=player.center, backend='numpy', **options)
+            assert (frame == expected).all()
+    monkeypatch.undo()
+    frames = list(animation.Animation(data, pov, antialias=True).play(updates))
+    assert len(frames) == 6 and (frames[-1] == frame).all() and (frames[2] == frames[3]).all()
+    # the work of a frame doesn't grow with the moves of former frames: the same update
+    #  draws as many lines as on a fresh animation of the moved graph
+    player = animation.Animation(data, pov)
+    for node in range(0, 1000, 5):
+        player.update([node], player.nodes[[node]] + 5)
+    assert player.moved_links.any()
+    fresh = animation.Animation(data._replace(nodes=player.nodes.copy()), pov)
+    drawn = []
+    draw_lines = raster.NumpyRasterizer.draw_lines
+    monkeypatch.setattr(raster.NumpyRasterizer, 'draw_lines', lambda self, segments, *args, **kwargs:
+                        drawn.append(len(segments)) or draw_lines(self, segments, *args, **kwargs))
+    counts = []
+    for animated in (player, fresh):
+        drawn.clear()
+        assert (animated.update([1500], data.nodes[[1500]] + 5) == fresh.frame).all()
+        counts.append(sum(drawn))
+    assert counts[0] == counts[1] > 0
+    monkeypatch.undo()
+    # links are indexed by the tiles crossed by their segment, not by their bounding box
+    segments, tiles = animation._segment_tiles(np.array([[[2., 3.], [157., 150.]], [[30., 8.], [31., 8.]]]), 16, (10, 10))
+    diagonal = set(tiles[segments == 0].tolist())
+    assert {11 * k for k in range(10)} <= diagonal and 9 not in diagonal and 90 not in diagonal
+    assert len(diagonal) < 40 and sorted(tiles[segments == 1].tolist()) == [1, 2]
+    for t in np.linspace(0, 1, 1000):
+        x, y = np.array([2., 3.]) * (1 - t) + np.array([157., 150.]) * t
+        assert int(y // 16) * 10 + int(x // 16) in diagonal
+    # moving most nodes triggers a new indexing of the tiles
+    player = animation.Animation(data, pov, tile_size=50)
+    player.update(np.arange(2000), data.nodes[:2000] + 1)
+    assert not player.moved_links.any()
+    assert (player.frame == render_gif.draw_projected_graph(player.projections, player.visible, data.links,
+                                                            fname=None, center=player.center, backend='numpy')).all()
+
+
+def test_profiling(tmp_path, capsys):
+    with diagnostics.profiling() as profiler:
+        frames = list(render_gif.run_things(graph.cube(), nb_point=3, fname_template=None))
+        render_gif.write_gif(frames, fname=str(tmp_path / 'graph.gif'))
+    assert capsys.readouterr().out == ''
+    assert set(profiler.summary()) == {'frame', *diagnostics.STAGES}
+    assert sorted(profiler.by_frame()) == [1, 2, 3]
+    assert all('projection' in stages for stages in profiler.by_frame().values())
+    assert diagnostics.PROFILER is None and diagnostics.stage('projection') is diagnostics.stage('encode')
+    profiler.to_chrome_trace(str(tmp_path / 'trace.json'))
+    with open(tmp_path / 'trace.json') as fd:
+        events = json.load(fd)['traceEvents']
+    assert len(events) == len(profiler.events) and all(event['ph'] == 'X' for event in events)
+
+
+def test_graph_generators():
+    for generator in (graph.random_cloud, graph.grid, graph.lattice, graph.scale_free):
+        data = generator(1000)
+        assert 800 <= len(data.nodes) <= 1200, generator
+        assert data == generator(1000)  # seeded
+    assert len(graph.random_cloud(50).nodes) == 50
+    assert graph.random_cloud(50, seed=1) != graph.random_cloud(50, seed=2)
+
+
+def test_bench_compare():
+    baseline = [bench.Result('grid', 10, 'projection', 1., 10., 'nodes/s', 0),
+                bench.Result('grid', 10, 'write_gif', 1., 1., 'frames/s', 0)]
+    results = [baseline[0]._replace(seconds=1.1), baseline[1]._replace(seconds=1.5),
+               baseline[1]._replace(size=100, seconds=10)]
+    assert bench.compare(results, baseline, tolerance=0.2) == [(results[1], baseline[1])]
+    # sub-millisecond stages twice slower are timing noise
+    fast = [result._replace(seconds=0.0005) for result in baseline]
+    assert bench.compare([fast[0]._replace(seconds=0.0011)], fast, tolerance=0.2) == []
+
+
+def test_array_graph():
+    for data in (graph.cube(), graph.double_tetrahedron()):
+        array_graph = graph.as_array_graph(data)
+        assert array_graph.nodes.shape == (len(data.nodes), 3)
+        assert array_graph.links.shape == (len(data.links), 2)
+        assert array_graph.center == data.center
+        assert array_graph.dimensions == data.dimensions
+        assert array_graph.amplitudes == data.amplitudes
+        assert set(graph.edges_from_array_graph(array_graph)) == set(data.links)
+        assert graph.as_array_graph(array_graph) is array_graph
+        assert (render_gif.draw_3d_graph(array_graph, (20, 4, 20), fname=None)
+                == render_gif.draw_3d_graph(data, (20, 4, 20), fname=None)).all()
+
+
+def test_loaders(tmp_path):
+    cube = graph.as_array_graph(graph.cube())
+    np.savetxt(tmp_path / 'points.csv', cube.nodes, delimiter=',', header='x,y,z')
+    np.savetxt(tmp_path / 'links.txt', cube.links, fmt='%d')
+    np.savetxt(tmp_path / 'edges.tsv', cube.nodes[cube.links].reshape(-1, 6), delimiter='\t')
+    np.save(tmp_path / 'points.npy', cube.nodes)
+    np.save(tmp_path / 'links.npy', cube.links)
+    cube.nodes.astype('<f4').tofile(str(tmp_path / 'points.raw'))
+    loaded = (
+        loaders.load(str(tmp_path / 'points.csv'), str(tmp_path / 'links.txt'), chunk_size=3),
+        loaders.load(str(tmp_path / 'edges.tsv'), chunk_size=5),
+        loaders.load(str(tmp_path / 'points.npy'), str(tmp_path / 'links.npy'), chunk_size=3),
+        loaders.load(str(tmp_path / 'points.raw'), str(tmp_path / 'links.npy'), chunk_size=3),
+    )
+    for data in loaded:
+        assert data.center == cube.center and data.amplitudes == cube.amplitudes
+        assert set(graph.edges_from_array_graph(data)) == set(graph.edges_from_array_graph(cube))
+    assert isinstance(loaded[2].nodes, np.memmap) and isinstance(loaded[3].nodes, np.memmap)
+    assert loaders.load(str(tmp_path / 'points.csv')).links.shape == (0, 2)
+    (tmp_path / 'header.csv').write_text('x,y,z\n' + ''.join('{},{},{}\n'.format(*node) for node in cube.nodes))
+    assert (loaders.load(str(tmp_path / 'header.csv')).nodes == cube.nodes).all()
+    (tmp_path / 'empty.csv').write_text('# x,y,z\n')
+    with pytest.raises(ValueError):
+        loaders.load(str(tmp_path / 'empty.csv'))
+    (tmp_path / 'mixed.txt').write_text('0 0 0 1 1 1\n2 2 2\n')
+    with pytest.raises(ValueError):
+        loaders.load(str(tmp_path / 'mixed.txt'), chunk_size=1)
+
+
+def test_out_of_core_rendering(tmp_path):
+    data = graph.as_array_graph(graph.random_cloud(20000, seed=2))
+    np.save(tmp_path / 'nodes.npy', data.nodes)
+    np.save(tmp_path / 'links.npy', data.links)
+    loaded = loaders.load(str(tmp_path / 'nodes.npy'), str(tmp_path / 'links.npy'))
+    for options in ({'backend': 'pil'}, {'backend': 'numpy', 'depth_test': True}):
+        expected = render_gif.draw_3d_graph(data, (400, 50, 50), fname=None, **options)
+        for chunk_size in (len(data.nodes), 1000):
+            image = render_gif.draw_3d_graph_out_of_core(loaded, (400, 50, 50), fname=None,
+                                                          chunk_size=chunk_size, workdir=str(tmp_path), **options)
+            assert (image == expected).all()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['links.npy', 'nodes.npy']  # temporary files removed
+    def peak_memory(func):
+        tracemalloc.start()
+        try:
+            func()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    assert peak_memory(lambda: render_gif.draw_3d_graph_out_of_core(loaded, (400, 50, 50), fname=None, chunk_size=1000)) \
+         < peak_memory(lambda: render_gif.draw_3d_graph(loaded, (400, 50, 50), fname=None)) / 4
+
+
+def test_octree_culling():
+    data = graph.as_array_graph(graph.random_cloud(3000, seed=4))
+    index = spatial.Octree.from_graph(data, leaf_size=16)
+    assert sorted(index.order) == list(range(len(data.nodes)))
+    for pov_coords in ((50, 50, -100), (50, 50, 50), (-20, 10, 30), (500, 50, 50)):
+        pov = projection.create_pov_toward(Coords(60, 40, 50), Coords(*pov_coords))
+        projections, visible = projection.project_many(data.nodes, pov)
+        candidates, links = index.cull(pov)
+        assert set(np.flatnonzero(visible)) <= set(candidates)  # no visible node culled
+        assert len(candidates) < len(data.nodes) or visible.all()
+        expected_links = {tuple(link) for link in data.links.tolist() if visible[link].all()}
+        kept_links = {tuple(link) for link in candidates[links].tolist()}
+        assert expected_links <= kept_links <= {tuple(link) for link in data.links.tolist()}
+        assert (render_gif.draw_3d_graph(data, pov_coords, fname=None, index=index)
+                == render_gif.draw_3d_graph(data, pov_coords, fname=None)).all()
+    # frames drawn by workers are culled the same way
+    sequential = render_gif.run_things(data, nb_point=4, fname_template=None, index=index)
+    parallel = render_gif.run_things(data, nb_point=4, fname_template=None, index=index, workers=2)
+    assert all((frame == expected).all() for frame, expected in zip(parallel, sequential))
+
+
+def test_level_of_detail():
+    data = graph.as_array_graph(graph.random_cloud(20000, seed=2))
+    full = render_gif.draw_3d_graph(data, (200, 50, 50), fname=None)
+    lod = render_gif.draw_3d_graph(data, (200, 50, 50), fname=None, lod_cell=4)
+    assert full.shape == lod.shape == (400, 400, 4)
+    # same regions are lit, with a density image of blocks of 4x4 pixels
+    lit, lod_lit = full[..., :3].any(axis=-1), lod[..., :3].any(axis=-1)
+    assert lod_lit.sum() >= lit.sum() * 0.5
+    assert (lod_lit.reshape(100, 4, 100, 4).any(axis=(1, 3))
+            >= lit.reshape(100, 4, 100, 4).any(axis=(1, 3))).mean() > 0.95
+    # sparse graphs keep their long edges
+    cube = render_gif.draw_3d_graph(graph.cube(), (20, 4, 20), fname=None)
+    assert (render_gif.draw_3d_graph(graph.cube(), (20, 4, 20), fname=None, lod_cell=2)[..., :3].any(axis=-1)
+            >= cube[..., :3].any(axis=-1) & (cube[..., :3] == 255).all(axis=-1)).all()
+    # denser cells are brighter
+    dense = [((x, 0.01, 0.5), (x + 0.001, 0.01, 0.5)) for x in (0.001, 0.004, 0.007, 0.01, 0.013)]
+    sparse = [((0.5, 0.5, 0.5), (0.501, 0.5, 0.5))]
+    lod = render_gif.draw_2d_graph(dense + sparse, fname=None, lod_cell=8)
+    assert lod[4, 4, 0] == 255 and 0 < lod[200, 200, 0] < 255
+
+
+def test_rasterizer_backends():
+    data = graph.as_array_graph(graph.random_cloud(2000, seed=3))
+    for graph_data, pov_coords in ((graph.cube(), (20, 4, 20)), (graph.double_tetrahedron(), (200, 50, 40)),
+                                   (data, (150, 50, 50)), (data, (50, 50, 50))):
+        reference = render_gif.draw_3d_graph(graph_data, pov_coords, fname=None, backend='pil')
+        assert (render_gif.draw_3d_graph(graph_data, pov_coords, fname=None, backend='numpy') == reference).all()
+        antialiased = render_gif.draw_3d_graph(graph_data, pov_coords, fname=None, backend='numpy', antialias=True)
+        assert antialiased[..., :3].any() == reference[..., :3].any()
+    rng = np.random.default_rng(0)
+    segments, positions = rng.uniform(-10, 50, (500, 2, 2)), rng.uniform(-5, 45, (500, 2))
+    sizes, colors = rng.uniform(0, 5, 500), rng.integers(0, 256, (500, 4))
+    rasterizers = raster.PILRasterizer(40, 30), raster.NumpyRasterizer(40, 30)
+    for rasterizer in rasterizers:
+        rasterizer.draw_lines(segments)
+        rasterizer.draw_squares(positions, sizes, colors)
+    assert (rasterizers[0].array() == rasterizers[1].array()).all()
+
+
+def test_depth_test():
+    # a near horizontal edge crossing a far vertical one, drawn in both orders
+    segments = np.array((((0, 10), (20, 10)), ((10, 0), (10, 20))), dtype=float)
+    depths = np.array(((2., 2.), (1., 1.)))
+    for order, antialias in itertools.product(((0, 1), (1, 0)), (False, True)):
+        rasterizer = raster.NumpyRasterizer(21, 21, depth_test=True, antialias=antialias)
+        rasterizer.draw_lines(segments[list(order)], raster.WHITE, depths=depths[list(order)])
+        rasterizer.draw_squares(((10, 10), (10, 2)), (2, 2), (raster.RED, raster.RED), depths=(1.5, 0.5))
+        pixels = rasterizer.array()
+        assert tuple(pixels[10, 10]) == raster.WHITE  # square behind the near edge
+        assert tuple(pixels[2, 10]) == raster.WHITE  # square behind the far edge
+        assert tuple(pixels[9, 10]) == raster.RED  # square over the far edge
+    # depth is interpolated along edges: the crossing point decides
+    rasterizer = raster.NumpyRasterizer(21, 21, depth_test=True)
+    rasterizer.draw_lines(segments, raster.WHITE, depths=((0., 2.), (1., 1.)))
+    rasterizer.draw_lines(segments[:1], raster.RED, depths=((0.5, 0.5),))
+    assert tuple(rasterizer.array()[10, 5]) == raster.RED
+    assert tuple(rasterizer.array()[10, 15]) == raster.WHITE
+    # full pipeline
+    data = graph.as_array_graph(graph.random_cloud(500, seed=1))
+    image = render_gif.draw_3d_graph(data, (150, 50, 50), fname=None, backend='numpy', depth_test=True)
+    assert image[..., :3].any()
+    with pytest.raises(ValueError):
+        raster.PILRasterizer(10, 10, depth_test=True)
+
+
+def test_render_service(tmp_path, monkeypatch):
+    service = render_service.RenderService(workers=2, queue_size=4).start()
+    server = render_service.make_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://{}:{}'.format(*server.server_address[:2])
+    def request(path, content=None):
+        data = None if content is None else json.dumps(content).encode()
+        try:
+            with urllib.request.urlopen(url + path, data=data) as answer:
+                return answer.status, json.load(answer)
+        except urllib.error.HTTPError as error:
+            return error.code, json.load(error)
+    try:
+        jobs = [request('/jobs', {'graph': {'generator': 'cloud', 'nb_node': 200}, 'nb_point': 3,
+                                  'gif': str(tmp_path / 'graph_{}.gif'.format(num)), 'index': bool(num)})
+                for num in range(3)]
+        assert all(code == 202 for code, _ in jobs)
+        for _, job in jobs:
+            code, job = request('/jobs/{}?wait=1'.format(job['id']))
+            assert code == 200 and job['status'] == 'done' and job['result']['nb_frame'] == 3
+        assert len(imageio.mimread(str(tmp_path / 'graph_2.gif'))) >= 1
+        assert request('/stats')[1]['graphs_loaded'] == 1  # the graph is loaded once
+        assert request('/jobs', {'graph': {'generator': 'unknown'}})[0] == 400
+        assert request('/jobs/1000')[0] == 404
+        code, job = request('/jobs', {'graph': {'file': str(tmp_path / 'missing.npy')}})
+        assert request('/jobs/{}?wait=1'.format(job['id']))[1]['status'] == 'failed'
+        assert request('/jobs', {'graph': {'generator': 'cloud', 'nb_node': 10}, 'draw_options': {'workers': 4}})[0] == 400
+        assert request('/jobs', {'graph': {'generator': 'cloud', 'size': 10}})[0] == 400
+        assert request('/jobs', {'graph': {'generator': 'cloud', 'nb_node': 10},
+                                 'camera': {'path': 'circle', 'radius': 400}})[0] == 400
+        code, job = request('/jobs', {'graph': {'generator': 'cloud', 'nb_node': 200},
+                                      'camera': {'path': 'spline', 'keyframes': [[400, 50, 50], [50, 50, 400]],
+                                                 'nb_frame': 4, 'threshold': 0.5},
+                                      'gif': str(tmp_path / 'path.gif'), 'index': True})
+        code, job = request('/jobs/{}?wait=1'.format(job['id']))
+        assert job['status'] == 'done' and job['result']['nb_frame'] == 4
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.stop()
+    # finished jobs are forgotten even behind an unfinished one
+    monkeypatch.setattr(render_service, 'MAX_JOBS', 2)
+    idle = render_service.RenderService(workers=0, queue_size=8)
+    jobs = [idle.submit({'graph': {'generator': 'cloud', 'nb_node': 10}}) for _ in range(3)]
+    for job in jobs[1:]:
+        job.done.set()
+    last = idle.submit({'graph': {'generator': 'cloud', 'nb_node': 10}})
+    assert list(idle.jobs) == [jobs[0].id, last.id]
+
+
+def test_projection_cache(tmp_path, monkeypatch):
+    data = graph.as_array_graph(graph.double_tetrahedron())
+    cache = cache_module.ProjectionCache(str(tmp_path / 'cache'))
+    expected = list(render_gif.run_things(data, nb_point=5, fname_template=None))
+    assert all((frame == image).all() for frame, image in zip(
+        render_gif.run_things(data, nb_point=5, fname_template=None, cache=cache), expected))
+    assert cache.stats()['misses'] == 5 and cache.stats()['entries'] == 5
+    frames = list(render_gif.run_things(data, nb_point=5, fname_template=None, cache=cache, frames_per_batch=2))
+    assert all((frame == image).all() for frame, image in zip(frames, expected))
+    assert cache.stats()['hits'] == 5 and cache.stats()['misses'] == 5
+    pov = projection.create_pov_toward(data.center, Coords(200, 50, 40))
+    projections, visible = cache.project_many(data.nodes, pov)
+    assert cache.stats()['misses'] == 6
+    cached_projections, cached_visible = cache.project_many(data.nodes, pov)
+    assert (cached_projections == projections).all() and (cached_visible == visible).all()
+    assert cache_module.graph_hash(data.nodes) != cache_module.graph_hash(data.nodes + 1)
+    # bounded size
+    small_cache = cache_module.ProjectionCache(str(tmp_path / 'small'), max_bytes=300)
+    list(render_gif.run_things(data, nb_point=5, fname_template=None, cache=small_cache))
+    assert small_cache.stats()['bytes'] <= 300 and small_cache.stats()['evictions'] > 0
+    assert small_cache.bytes == small_cache.stats()['bytes']
+    assert cache_module.ProjectionCache(str(tmp_path / 'cache')).bytes == cache.stats()['bytes']
+    # frames rendered one by one hash the graph once
+    hashes = []
+    graph_hash = cache_module.graph_hash
+    monkeypatch.setattr(cache_module, 'graph_hash', lambda *args: hashes.append(1) or graph_hash(*args))
+    list(render_gif.run_things(data, nb_point=5, fname_template=None, cache=cache, orbit=False))
+    assert len(hashes) == 1
+    # a file removed by another process just after its reading is still a hit
+    def utime(path):
+        raise FileNotFoundError(path)
+    monkeypatch.setattr(cache_module.os, 'utime', utime)
+    hits = cache.hits
+    assert cache.project_many(data.nodes, pov) is not None and cache.hits == hits + 1